@@ -0,0 +1,30 @@
+"""indice compuesto de mensajes por conversacion y fecha
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Historial: WHERE conversation_id = ? ORDER BY timestamp DESC + TOP N sin ordenar en memoria.
+    # El índice ascendente sirve igual para DESC (recorrido hacia atrás); las columnas incluidas
+    # lo hacen cubriente para la consulta del endpoint /historial.
+    op.create_index(
+        'ix_messages_conv_ts', 'messages', ['conversation_id', 'timestamp'],
+        unique=False,
+        mssql_include=['sender_type', 'text_content', 'button_selected'],
+        postgresql_include=['sender_type', 'text_content', 'button_selected']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_messages_conv_ts', table_name='messages')
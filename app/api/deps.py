@@ -4,7 +4,7 @@ from fastapi import Depends, HTTPException, status, Security
 from fastapi.security import OAuth2PasswordBearer, SecurityScopes
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
-from app.core.config import settings
+from app.core.config import get_settings
 from app.db.session import SessionLocal
 from app import models, schemas
 oauth2_scheme = OAuth2PasswordBearer(
@@ -12,12 +12,10 @@ oauth2_scheme = OAuth2PasswordBearer(
     scopes={"read": "Leer datos", "write": "Escribir datos"}
 )
 def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+    with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 def _decode_token(token: str, credentials_exception):
+    settings = get_settings()
     try:
         payload = jwt.decode(
             token,
@@ -7,9 +7,9 @@ import pandas as pd
 import json
 import tempfile
 import os
-from pydantic_settings import BaseSettings
 from datetime import datetime
 from app.services.cache_service import cache_service
+from app.services.conversation_service import invalidar_cache_templates, invalidar_cache_clientes
 from app.services.state_condition_bridge import StateConditionBridge
 from app.api.deps import get_db, get_current_active_admin
 from app.schemas.chat import ConfiguracionEstado
@@ -20,7 +20,7 @@ router = APIRouter(
 )
 
 @router.post("/validate-dynamic-system")
-async def validate_dynamic_system(db: Session = Depends(get_db)):
+def validate_dynamic_system(db: Session = Depends(get_db)):
     """✅ VALIDACIÓN COMPLETA DEL SISTEMA 100% DINÁMICO"""
     
     validation_results = {
@@ -81,7 +81,7 @@ async def validate_dynamic_system(db: Session = Depends(get_db)):
         return {"success": False, "error": str(e)}
 
 @router.post("/fix-dynamic-system")
-async def fix_dynamic_system(db: Session = Depends(get_db)):
+def fix_dynamic_system(db: Session = Depends(get_db)):
     """✅ AUTO-CORRECCIÓN DEL SISTEMA DINÁMICO"""
     
     fixes_applied = []
@@ -112,6 +112,7 @@ async def fix_dynamic_system(db: Session = Depends(get_db)):
                 fixes_applied.append(f"Estado {estado} corregido")
         
         db.commit()
+        invalidar_cache_templates()
         
         return {
             "success": True,
@@ -124,7 +125,7 @@ async def fix_dynamic_system(db: Session = Depends(get_db)):
         return {"success": False, "error": str(e)}
 
 @router.get("/dynamic-system-status")
-async def get_dynamic_system_status(db: Session = Depends(get_db)):
+def get_dynamic_system_status(db: Session = Depends(get_db)):
     """✅ STATUS RÁPIDO DEL SISTEMA DINÁMICO"""
     try:
         # Contar registros en tablas críticas
@@ -157,7 +158,7 @@ async def get_dynamic_system_status(db: Session = Depends(get_db)):
         return {"system_health": "ERROR", "error": str(e)}
 
 @router.get("/verificar-sistema-dinamico")
-async def verificar_sistema_dinamico(db: Session = Depends(get_db)):
+def verificar_sistema_dinamico(db: Session = Depends(get_db)):
     """Verificar que el sistema sea 100% dinámico"""
     
     verificaciones = {
@@ -202,7 +203,7 @@ async def verificar_sistema_dinamico(db: Session = Depends(get_db)):
         return {"error": str(e)}
     
 @router.post("/fix-estados-constraint")
-async def fix_estados_constraint(db: Session = Depends(get_db)):
+def fix_estados_constraint(db: Session = Depends(get_db)):
     """Agregar estados faltantes al CHECK constraint"""
     try:
         # 1. Verificar estados actuales permitidos
@@ -288,7 +289,7 @@ def listar_estados_completo(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error obteniendo estados: {e}")
 
 @router.post("/api/v1/admin/test-bridge")
-async def test_bridge_endpoint(
+def test_bridge_endpoint(
         estado_actual: str = Form(...),
         mensaje: str = Form(...),
         intencion: str = Form(...),
@@ -362,6 +363,7 @@ def crear_estado_completo(
             "activo": activo
         })
         db.commit()
+        invalidar_cache_templates()
         return {
             "message": f"Estado '{nombre}' creado exitosamente",
             "estado": {
@@ -420,6 +422,7 @@ def actualizar_estado_completo(
             raise HTTPException(status_code=404, detail="Estado no encontrado")
         
         db.commit()
+        invalidar_cache_templates()
         
         return {"message": f"Estado '{nombre_estado}' actualizado exitosamente"}
         
@@ -447,6 +450,7 @@ def eliminar_estado(
             raise HTTPException(status_code=404, detail="Estado no encontrado")
         
         db.commit()
+        invalidar_cache_templates()
         
         return {"message": f"Estado '{nombre_estado}' desactivado exitosamente"}
         
@@ -455,7 +459,7 @@ def eliminar_estado(
         raise HTTPException(status_code=500, detail=f"Error eliminando estado: {e}")
 
 @router.post("/estados/importar-excel")
-async def importar_estados_desde_excel(
+def importar_estados_desde_excel(
     archivo: UploadFile = File(...),
     sobrescribir: bool = Form(False),
     db: Session = Depends(get_db),
@@ -467,8 +471,8 @@ async def importar_estados_desde_excel(
         raise HTTPException(status_code=400, detail="Archivo debe ser Excel (.xlsx o .xls)")
     
     try:
-        # Leer archivo Excel
-        content = await archivo.read()
+        # Leer archivo Excel (endpoint síncrono: lectura directa del archivo temporal de la subida)
+        content = archivo.file.read()
         
         with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
             tmp_file.write(content)
@@ -564,6 +568,7 @@ async def importar_estados_desde_excel(
                 continue
         
         db.commit()
+        invalidar_cache_templates()
         
         return {
             "message": "Importación completada",
@@ -815,12 +820,15 @@ def get_cache_stats():
 def clear_cache():
     """Limpiar todo el cache (¡CUIDADO!)"""
     result = cache_service.clear_all_cache()
+    invalidar_cache_templates()
+    invalidar_cache_clientes()
     return {"success": result, "message": "Cache limpiado" if result else "Error limpiando cache"}
 
 @router.post("/clear/client/{cedula}")
 def clear_client_cache(cedula: str):
     """Limpiar cache de un cliente específico"""
     result = cache_service.invalidate_client_cache(cedula)
+    invalidar_cache_clientes(cedula)
     return {"success": result, "message": f"Cache de cliente {cedula} limpiado"}
 
 @router.post("/clear/conversation/{conversation_id}")
@@ -845,24 +853,8 @@ def cleanup_expired_cache():
     return {"cleaned_keys": cleaned, "message": f"{cleaned} claves expiradas limpiadas"}
 
 
-
-
-class Settings(BaseSettings):
-    REDIS_HOST: str = "localhost"
-    REDIS_PORT: int = 6379
-    REDIS_PASSWORD: Optional[str] = None
-    REDIS_DB: int = 0
-    REDIS_ENABLED: bool = True
-    REDIS_DEFAULT_TTL: int = 3600
-    REDIS_COMPRESSION_THRESHOLD: int = 1000
-    CACHE_CLIENT_TTL: int = 7200
-    CACHE_ML_TTL: int = 1800
-    CACHE_OPENAI_TTL: int = 3600
-    CACHE_VARIABLES_TTL: int = 1800
-    CACHE_CONTEXT_TTL: int = 3600
-
 @router.get("/api/v1/admin/dynamic-system/stats")
-async def get_dynamic_system_stats(db: Session = Depends(get_db)):
+def get_dynamic_system_stats(db: Session = Depends(get_db)):
     """Obtener estadísticas del sistema dinámico"""
     try:
         from app.services.dynamic_transition_service import create_dynamic_transition_service
@@ -883,7 +875,7 @@ async def get_dynamic_system_stats(db: Session = Depends(get_db)):
         }
 
 @router.post("/api/v1/admin/dynamic-system/add-pattern")
-async def add_keyword_pattern(
+def add_keyword_pattern(
     keyword: str = Form(...),
     condition: str = Form(...),
     confidence: float = Form(0.8),
@@ -929,7 +921,7 @@ async def add_keyword_pattern(
         }
 
 @router.post("/api/v1/admin/dynamic-system/add-ml-mapping")
-async def add_ml_mapping(
+def add_ml_mapping(
     ml_intention: str = Form(...),
     bd_condition: str = Form(...),
     confidence_threshold: float = Form(0.7),
@@ -966,7 +958,7 @@ async def add_ml_mapping(
         }
 
 @router.get("/api/v1/admin/dynamic-system/patterns")
-async def list_dynamic_patterns(db: Session = Depends(get_db)):
+def list_dynamic_patterns(db: Session = Depends(get_db)):
     """Listar todos los patrones dinámicos"""
     try:
         # Patrones de palabras clave
@@ -1026,7 +1018,7 @@ async def list_dynamic_patterns(db: Session = Depends(get_db)):
         }
 
 @router.post("/api/v1/admin/dynamic-system/auto-improve")
-async def trigger_auto_improvement(db: Session = Depends(get_db)):
+def trigger_auto_improvement(db: Session = Depends(get_db)):
     """Disparar auto-mejora del sistema"""
     try:
         from app.services.dynamic_transition_service import create_dynamic_transition_service
@@ -1047,7 +1039,7 @@ async def trigger_auto_improvement(db: Session = Depends(get_db)):
         }
 
 @router.get("/api/v1/admin/dynamic-system/decisions-log")
-async def get_decisions_log(
+def get_decisions_log(
     limit: int = Query(50, ge=1, le=200),
     conversation_id: Optional[int] = Query(None),
     db: Session = Depends(get_db)
@@ -1100,7 +1092,7 @@ async def get_decisions_log(
         }
 
 @router.post("/api/v1/admin/dynamic-system/test-transition")
-async def test_dynamic_transition(
+def test_dynamic_transition(
     current_state: str = Form(...),
     user_message: str = Form(...),
     ml_intention: str = Form("TEST_INTENTION"),
@@ -1,7 +1,9 @@
 from pydantic_settings import BaseSettings
+from functools import lru_cache
 from typing import Optional
 import os
-from pydantic import validator
+import urllib.parse
+from pydantic import computed_field
 
 class Settings(BaseSettings):
     """
@@ -41,9 +43,6 @@ class Settings(BaseSettings):
     RULES_ENABLED: bool = True
     RULES_PRIORITY_MODE: bool = True  
     
-    # LOGGING
-    LOG_LEVEL: str = "INFO"
-
     # JERARQUÍA
 
     TIMEOUT_RULES: int = 10      
@@ -68,10 +67,6 @@ class Settings(BaseSettings):
     LOG_SYSTEM_DECISIONS: bool = True
     DEBUG_MODE: bool = False
     
-    ML_ENABLE_HYBRID_DETECTION: bool = True
-    ML_SAVE_INTERACTIONS: bool = True
-    ML_AUTO_IMPROVE: bool = True
-    
     # CARACTERÍSTICAS DEL SISTEMA
     COMPANY_NAME: str = "Systemgroup"
     COMPANY_PHONE: str = "+57 3214929276"
@@ -82,18 +77,58 @@ class Settings(BaseSettings):
     CHAT_ENABLE_EMPATHY_MODE: bool = True
     CHAT_MAX_CONTEXT_SIZE: int = 100
     
+    # REDIS Y CACHE
+    REDIS_HOST: str = "localhost"
+    REDIS_PORT: int = 6379
+    REDIS_PASSWORD: Optional[str] = None
+    REDIS_DB: int = 0
+    REDIS_ENABLED: bool = True
+    REDIS_DEFAULT_TTL: int = 3600
+    REDIS_COMPRESSION_THRESHOLD: int = 1000
+    CACHE_CLIENT_TTL: int = 7200
+    CACHE_ML_TTL: int = 1800
+    CACHE_OPENAI_TTL: int = 3600
+    CACHE_VARIABLES_TTL: int = 1800
+    CACHE_CONTEXT_TTL: int = 3600
+    
+    @computed_field
+    @property
+    def DATABASE_URI(self) -> str:
+        """URL de SQLAlchemy: DATABASE_URL si está definida, si no SQL Server con autenticación integrada"""
+        if self.DATABASE_URL:
+            return self.DATABASE_URL
+        
+        odbc_str = (
+            "DRIVER={ODBC Driver 17 for SQL Server};"
+            f"SERVER={self.SQLSERVER_SERVER};"
+            f"DATABASE={self.SQLSERVER_DB};"
+            "Trusted_Connection=yes;"
+        )
+        return f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(odbc_str)}"
+    
     class Config:
         extra = "allow" 
         env_file = ".env"
         env_file_encoding = "utf-8"
         case_sensitive = False
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Instancia única de Settings (lectura de entorno y .env en el primer uso, no al importar)"""
+    return Settings()
+
+
+def __getattr__(name):
+    # Compatibilidad: `from app.core.config import settings` sigue funcionando, resuelto de forma perezosa
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # VALIDACIONES Y CONFIGURACIONES ADICIONALES
 
 def validate_settings():
-    """Validar configuraciones críticas"""
+    """Validar configuraciones críticas (se invoca explícitamente al arrancar la aplicación)"""
+    settings = get_settings()
     
     if settings.OPENAI_API_KEY:
         print(f"✅ OpenAI configurado: {settings.OPENAI_API_KEY[:20]}...")
@@ -107,19 +142,12 @@ def validate_settings():
     
     return True
 
-try:
-    validate_settings()
-except Exception as e:
-    print(f"⚠️ Error en validación de configuración: {e}")
-
 # ===== UTILIDADES =====
 def get_database_url():
     """Generar URL de base de datos"""
-    if settings.DATABASE_URL:
-        return settings.DATABASE_URL
-    
-    return f"mssql+pyodbc:///?odbc_connect=DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={settings.SQLSERVER_SERVER};DATABASE={settings.SQLSERVER_DB};Trusted_Connection=yes"
+    return get_settings().DATABASE_URI
 
 def is_openai_enabled():
     """Verificar si OpenAI está habilitado"""
+    settings = get_settings()
     return bool(settings.OPENAI_API_KEY and len(settings.OPENAI_API_KEY) > 20)
\ No newline at end of file
@@ -6,6 +6,10 @@ from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import json
 from datetime import datetime, date
+try:
+    import orjson
+except ImportError:
+    orjson = None
 def setup_logging():
     log_level = os.getenv("LOG_LEVEL", "INFO")
     numeric_level = getattr(logging, log_level.upper(), None)
@@ -31,12 +35,19 @@ class StructuredLogger:
     def __init__(self, logger_name: str = "app"):
         self.logger = logging.getLogger(logger_name)
     def _log(self, level: int, message: str, **kwargs):
+        # Registro descartado por nivel: no se arma el dict ni se serializa
+        if not self.logger.isEnabledFor(level):
+            return
         log_data = {
             "message": message,
             "timestamp": datetime.now(),
             **kwargs
         }
-        json_data = json.dumps(log_data, cls=CustomJSONEncoder)
+        if orjson is not None:
+            # orjson serializa datetime de forma nativa (hora local, igual que isoformat)
+            json_data = orjson.dumps(log_data, default=str).decode()
+        else:
+            json_data = json.dumps(log_data, cls=CustomJSONEncoder)
         self.logger.log(level, json_data)
     def info(self, message: str, **kwargs):
         self._log(logging.INFO, message, **kwargs)
@@ -1,20 +1,24 @@
-import urllib.parse
+import os
 from sqlalchemy import create_engine, text 
 from sqlalchemy.orm import sessionmaker
+from app.core.config import get_settings
 from app.db.base import Base
 
 
-odbc_str = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=172.18.79.20,1433;"
-    "DATABASE=turnosvirtuales_dev;"
-    "Trusted_Connection=yes;"
-)
-params = urllib.parse.quote_plus(odbc_str)
+# ✅ POOL DIMENSIONADO PARA LA CONCURRENCIA DE LOS ENDPOINTS (sobrescribible por entorno)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", max(20, (os.cpu_count() or 1) * 5)))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 5))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
 
 engine = create_engine(
-    f"mssql+pyodbc:///?odbc_connect={params}",
+    get_settings().DATABASE_URI,  # misma URL que alembic (SQLSERVER_SERVER/SQLSERVER_DB o DATABASE_URL)
     pool_pre_ping=True,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+    pool_use_lifo=True,  # reutiliza la conexión más reciente: las sobrantes quedan ociosas y se reciclan
     echo=False
 )
 
@@ -25,12 +29,9 @@ from app.models.conversation import Conversation
 from app.models.message import Message
 
 def get_db():
-    """Generador de sesiones de BD"""
-    db = SessionLocal()
-    try:
+    """Generador de sesiones de BD (la sesión se cierra al salir del contexto)"""
+    with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def test_connection():
     """Prueba la conexión a BD"""
@@ -1,14 +1,77 @@
 from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import relationship
 from app.db.base import Base
-from datetime import datetime
+from datetime import datetime, date
+from decimal import Decimal
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(obj):
+    """Tipos no nativos de JSON (mismo criterio que CustomJSONEncoder)"""
+    if isinstance(obj, Decimal):
+        return int(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+class JSONText(TypeDecorator):
+    """
+    JSON almacenado como texto (NVARCHAR(MAX) en SQL Server, compatible con JSON_VALUE).
+    Escritura: dict → JSON (un str ya serializado pasa sin cambios). Lectura: JSON → dict.
+    SQL Server no tiene tipo JSON nativo (equivalente a JSONB): se guarda como texto para que
+    el scheduler pueda filtrar con JSON_VALUE(context_data, '$.clave') del lado del servidor.
+    """
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        if orjson is not None:
+            return orjson.dumps(value, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+    
+    def process_result_value(self, value, dialect):
+        if not value:
+            return None
+        try:
+            return orjson.loads(value) if orjson is not None else json.loads(value)
+        except ValueError:
+            logger.warning("⚠️ context_data con JSON inválido, se ignora")
+            return None
+
+
+class ContextoMutable(MutableDict):
+    """
+    Dict con seguimiento de cambios para context_data: JSONText compara valores al hacer
+    flush, así que modificar en sitio el dict cargado y reasignarlo no emitiría UPDATE.
+    Valores heredados que no son dict (p. ej. una lista guardada) se cargan sin seguimiento.
+    """
+    
+    @classmethod
+    def coerce(cls, key, value):
+        if value is not None and not isinstance(value, dict):
+            return value
+        return super().coerce(key, value)
+
 
 class Conversation(Base):
     __tablename__ = "conversations"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     current_state = Column(String(100), default="inicial")
-    context_data = Column(Text, nullable=True)
+    context_data = Column(ContextoMutable.as_mutable(JSONText), nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.db.base import Base
 from datetime import datetime
@@ -16,5 +16,14 @@ class Message(Base):
     timestamp = Column(DateTime, nullable=False, default=datetime.utcnow)
     conversation = relationship("Conversation", back_populates="messages", lazy="select")
     
+    # Cubre el historial (conversation_id + ORDER BY timestamp DESC TOP N); ver migración 002
+    __table_args__ = (
+        Index(
+            'ix_messages_conv_ts', 'conversation_id', 'timestamp',
+            mssql_include=['sender_type', 'text_content', 'button_selected'],
+            postgresql_include=['sender_type', 'text_content', 'button_selected']
+        ),
+    )
+    
     def __repr__(self):
         return f"<Message(id={self.id}, conversation_id={self.conversation_id}, sender='{self.sender_type}')>"
\ No newline at end of file
@@ -1,8 +1,20 @@
 import logging
+import re
 from typing import Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# ✅ PALABRAS CLAVE PRECOMPILADAS: una sola alternación por condición, recorrida en C
+# (misma semántica de subcadena que `any(palabra in mensaje ...)`, sin distinguir mayúsculas)
+_PALABRAS_PLAN = ('1', '2', '3', 'uno', 'dos', 'tres', 'primero', 'segundo', 'tercero',
+                  'pago único', 'cuotas', 'plan')
+_PALABRAS_FRUSTRACION = ('no puedo', 'imposible', 'no tengo', 'dificil', 'problema',
+                         'no entiendo', 'complicado', 'ayuda', 'perdido', 'confundido')
+
+_PLAN_RE = re.compile('|'.join(map(re.escape, _PALABRAS_PLAN)), re.IGNORECASE)
+_FRUSTRACION_RE = re.compile('|'.join(map(re.escape, _PALABRAS_FRUSTRACION)), re.IGNORECASE)
+_CEDULA_RE = re.compile(r'\b\d{7,10}\b')
+
 class CondicionesService:
     """Servicio para evaluar condiciones de negocio"""
     
@@ -41,44 +53,23 @@ class CondicionesService:
     
     def _cliente_selecciona_plan(self, contexto: Dict[str, Any]) -> bool:
         """Verifica si el cliente seleccionó un plan"""
-        mensaje = contexto.get('mensaje', '').lower()
-        plan_seleccionado = contexto.get('plan_seleccionado')
-        
-
-        palabras_plan = ['1', '2', '3', 'uno', 'dos', 'tres', 'primero', 'segundo', 'tercero', 
-                        'pago único', 'cuotas', 'plan']
-        
-        if plan_seleccionado:
+        if contexto.get('plan_seleccionado'):
             return True
             
-        return any(palabra in mensaje for palabra in palabras_plan)
+        return _PLAN_RE.search(contexto.get('mensaje', '')) is not None
     
     def _cliente_muestra_frustracion(self, contexto: Dict[str, Any]) -> bool:
         """Detecta signos de frustración en el cliente"""
-        mensaje = contexto.get('mensaje', '').lower()
-        
-        palabras_frustracion = [
-            'no puedo', 'imposible', 'no tengo', 'dificil', 'problema',
-            'no entiendo', 'complicado', 'ayuda', 'perdido', 'confundido'
-        ]
-        
-        return any(palabra in mensaje for palabra in palabras_frustracion)
+        return _FRUSTRACION_RE.search(contexto.get('mensaje', '')) is not None
     
     def _tiene_documento_valido(self, contexto: Dict[str, Any]) -> bool:
         """Verifica si el documento es válido"""
         documento = contexto.get('documento', '')
-        mensaje = contexto.get('mensaje', '')
-        
-        import re
-        patron_cedula = r'\b\d{7,10}\b'
         
         if documento and len(documento) >= 7:
             return True
             
-        if re.search(patron_cedula, mensaje):
-            return True
-            
-        return False
+        return _CEDULA_RE.search(contexto.get('mensaje', '')) is not None
     
     def _saldo_mayor_1000(self, contexto: Dict[str, Any]) -> bool:
         """Verifica si el saldo es mayor a $1000"""
@@ -1,7 +1,11 @@
-import json
+import asyncio
+import copy
 import re
 import logging
+import threading
 import time
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import text
@@ -12,20 +16,143 @@ from app.services.dynamic_transition_service import create_dynamic_transition_se
 
 logger = logging.getLogger(__name__)
 
-class ConversationService:
-    """✅ VERSIÓN CORREGIDA - Sistema 100% dinámico sin hardcoding"""
+# ✅ CACHE DE TEMPLATES POR ESTADO (tabla pequeña y casi estática)
+_TEMPLATE_CACHE_TTL = 300  # segundos
+_template_cache: Dict[str, str] = {}
+_template_cache_timestamp = 0.0
+_template_cache_lock = threading.Lock()
+
+_TEMPLATES_ACTIVOS_QUERY = text("""
+    SELECT nombre, mensaje_template 
+    FROM Estados_Conversacion 
+    WHERE activo = 1
+""")
+
+_CLIENTE_REAL_QUERY = text("""
+    SELECT TOP 1 
+        Nombre_del_cliente, Saldo_total, banco,
+        Oferta_1, Oferta_2, 
+        Hasta_3_cuotas, Hasta_6_cuotas, Hasta_12_cuotas,
+        Producto, Telefono, Email
+    FROM ConsolidadoCampañasNatalia 
+    WHERE CAST(Cedula AS VARCHAR) = :cedula
+    ORDER BY Saldo_total DESC
+""")
+
+# ✅ CACHE LRU DE CLIENTES POR CÉDULA (la misma cédula se consulta en varios turnos seguidos)
+_CLIENTE_CACHE_TTL = 60  # segundos; el saldo de campaña no cambia dentro de una conversación
+_CLIENTE_NO_ENCONTRADO_TTL = 5  # segundos; un cliente recién cargado no debe quedar "no encontrado" un minuto
+_CLIENTE_CACHE_MAX = 1024
+_cliente_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_cliente_cache_lock = threading.Lock()
+
+
+def _cliente_cache_get(cedula: str) -> Optional[Dict[str, Any]]:
+    """Copia de los datos cacheados de la cédula o None si no están o vencieron"""
+    with _cliente_cache_lock:
+        entrada = _cliente_cache.get(cedula)
+        if entrada is None:
+            return None
+        if time.monotonic() > entrada[0]:
+            del _cliente_cache[cedula]
+            return None
+        _cliente_cache.move_to_end(cedula)
+        return dict(entrada[1])
+
+
+def _cliente_cache_set(cedula: str, datos: Dict[str, Any], ttl: float = _CLIENTE_CACHE_TTL):
+    with _cliente_cache_lock:
+        _cliente_cache[cedula] = (time.monotonic() + ttl, dict(datos))
+        _cliente_cache.move_to_end(cedula)
+        if len(_cliente_cache) > _CLIENTE_CACHE_MAX:
+            _cliente_cache.popitem(last=False)
+
+
+def invalidar_cache_clientes(cedula: Optional[str] = None):
+    """Vaciar la cache de clientes, o solo la de una cédula (p. ej. tras recargar ConsolidadoCampañasNatalia)"""
+    with _cliente_cache_lock:
+        if cedula is None:
+            _cliente_cache.clear()
+        else:
+            _cliente_cache.pop(str(cedula), None)
+
+
+# ✅ PATRONES DE CÉDULA PRECOMPILADOS (las tres palabras clave en una sola alternación)
+_CEDULA_AISLADA_RE = re.compile(r'\b(\d{7,12})\b')
+_CEDULA_CLAVE_RE = re.compile(r'(?:c[eé]dula|documento|cc)\s*:?\s*(\d{7,12})', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _extraer_cedula(mensaje: str) -> Optional[str]:
+    """
+    Cédula del mensaje (número aislado primero, luego precedido de palabra clave).
+    Memoizada: un turno consulta el mismo mensaje en el reset, el contexto y el
+    procesamiento, y solo el primero recorre el texto.
+    """
+    for patron in (_CEDULA_AISLADA_RE, _CEDULA_CLAVE_RE):
+        for match in patron.findall(mensaje):
+            if len(set(match)) > 1:
+                return match
+    return None
+
+
+# ✅ BOTONES PRECONSTRUIDOS: (estado, tiene_cliente) → botones (compartidos, solo lectura)
+_BOTONES_ACUERDO = (
+    {"id": "confirmar", "text": "Confirmar acuerdo"},
+    {"id": "modificar", "text": "Modificar términos"}
+)
+_BOTONES_POR_ESTADO = {
+    ("informar_deuda", True): (
+        {"id": "si_opciones", "text": "Sí, quiero ver opciones"},
+        {"id": "no_ahora", "text": "No por ahora"}
+    ),
+    ("proponer_planes_pago", True): (
+        {"id": "pago_unico", "text": "Pago único"},
+        {"id": "plan_3_cuotas", "text": "3 cuotas"},
+        {"id": "plan_6_cuotas", "text": "6 cuotas"},
+        {"id": "plan_12_cuotas", "text": "12 cuotas"}
+    ),
+    ("generar_acuerdo", True): _BOTONES_ACUERDO,
+    ("generar_acuerdo", False): _BOTONES_ACUERDO,
+}
+_BOTONES_AYUDA = ({"id": "ayuda", "text": "Necesito ayuda"},)
+
+
+def obtener_template_estado(db: Session, estado: str) -> Optional[str]:
+    """Template activo del estado; recarga todos los templates activos al vencer el TTL"""
+    global _template_cache, _template_cache_timestamp
     
-    def __init__(self, db: Session):
-        self.db = db
-        self.variable_service = crear_variable_service(db)
+    if time.time() - _template_cache_timestamp > _TEMPLATE_CACHE_TTL:
+        with _template_cache_lock:
+            # Un solo hilo recarga; los que esperaban el lock usan lo que éste cargó
+            if time.time() - _template_cache_timestamp > _TEMPLATE_CACHE_TTL:
+                rows = db.execute(_TEMPLATES_ACTIVOS_QUERY).fetchall()
+                _template_cache = {row[0]: row[1] for row in rows if row[1]}
+                _template_cache_timestamp = time.time()
+                logger.info(f"🔄 Cache de templates recargado: {len(_template_cache)} estados")
+    
+    return _template_cache.get(estado)
+
+
+def invalidar_cache_templates():
+    """Forzar recarga de templates en la próxima consulta"""
+    global _template_cache_timestamp
+    _template_cache_timestamp = 0.0
+
+class _ServiciosConversacion:
+    """
+    Servicios compartidos por todos los ConversationService del proceso.
+    ML y la configuración de transiciones cargada desde BD no dependen de la
+    sesión; los servicios que consultan BD se enlazan por request.
+    """
+    
+    def __init__(self):
         self.ml_service = self._init_ml_service()
-        self.dynamic_transition_service = create_dynamic_transition_service(db)
-        self.request_count = 0
+        self.ml_predict = self._init_ml_predict()
+        self._transiciones = None
+        self._transiciones_lock = threading.Lock()
         
-        # ✅ ELIMINAR CACHE PERSISTENTE - CADA CONVERSACIÓN DEBE SER LIMPIA
-        self.session_cache = {}  # Solo para sesión actual
-        
-        logger.info("✅ ConversationService inicializado (versión dinámica corregida)")
+        logger.info("✅ Servicios de conversación inicializados (compartidos por proceso)")
     
     def _init_ml_service(self):
         """Inicializar servicio ML de forma segura"""
@@ -36,57 +163,150 @@ class ConversationService:
             logger.warning(f"ML service no disponible: {e}")
             return None
     
+    def _init_ml_predict(self):
+        """Predicción ML con cache por proceso (fallback: predict directo)"""
+        try:
+            from app.services.nlp_service import predict_cached
+            return predict_cached
+        except Exception:
+            return self.ml_service.predict if self.ml_service else None
+    
+    def transiciones_para(self, db: Session):
+        """
+        Servicio de transiciones enlazado a la sesión del request.
+        La configuración se carga una vez (y al vencer su TTL) en una instancia nueva
+        que reemplaza a la compartida bajo lock: la compartida nunca se modifica en
+        sitio, así que cada request copia siempre una instancia cargada por completo.
+        """
+        transiciones = self._transiciones
+        if transiciones is None or self._transiciones_vencidas(transiciones):
+            with self._transiciones_lock:
+                # Otro hilo pudo recargar mientras se esperaba el lock
+                transiciones = self._transiciones
+                if transiciones is None or self._transiciones_vencidas(transiciones):
+                    transiciones = create_dynamic_transition_service(db)
+                    # La instancia compartida no retiene la sesión del request que la cargó
+                    transiciones.db = None
+                    self._transiciones = transiciones
+        
+        servicio = copy.copy(transiciones)
+        servicio.db = db
+        return servicio
+    
+    @staticmethod
+    def _transiciones_vencidas(transiciones) -> bool:
+        return time.time() - transiciones.cache_timestamp > transiciones.cache_ttl
+
+
+@lru_cache(maxsize=1)
+def _obtener_servicios_conversacion() -> _ServiciosConversacion:
+    """Instancia única de los servicios compartidos (creación perezosa)"""
+    return _ServiciosConversacion()
+
+
+class ConversationService:
+    """✅ VERSIÓN CORREGIDA - Sistema 100% dinámico sin hardcoding"""
+    
+    def __init__(self, db: Session, servicios: Optional[_ServiciosConversacion] = None):
+        # Los servicios independientes de la sesión se construyen una vez por proceso;
+        # aquí solo se enlazan a la sesión del request
+        servicios = servicios or _obtener_servicios_conversacion()
+        self.db = db
+        self.variable_service = crear_variable_service(db)
+        self.ml_service = servicios.ml_service
+        self._ml_predict = servicios.ml_predict
+        self.dynamic_transition_service = servicios.transiciones_para(db)
+        self.request_count = 0
+        
+        # ✅ ELIMINAR CACHE PERSISTENTE - CADA CONVERSACIÓN DEBE SER LIMPIA
+        self.session_cache = {}  # Solo para sesión actual
+        
+        logger.debug("✅ ConversationService enlazado a la sesión")
+    
     async def process_message(self, conversation_id: int, user_message: str, user_id: int) -> Dict:
-        """✅ MÉTODO PRINCIPAL CORREGIDO - Limpieza y dinámico"""
+        """Versión awaitable: el trabajo es síncrono (BD), se ejecuta en un hilo para no bloquear el event loop"""
+        return await asyncio.to_thread(self.process_message_sync, conversation_id, user_message, user_id)
+    
+    def process_message_sync(self, conversation_id: int, user_message: str, user_id: int,
+                             now: Optional[datetime] = None, persistir: bool = True) -> Dict:
+        """
+        ✅ MÉTODO PRINCIPAL CORREGIDO - Limpieza y dinámico (now: instante único del request).
+        Con persistir=False los cambios quedan en la conversación de la sesión sin commit:
+        el llamador los escribe junto con los suyos en un solo UPDATE por turno.
+        """
         start_time = time.time()
+        now = now or datetime.now()
         self.request_count += 1
         
         try:
-            logger.info(f"📨 [{self.request_count}] Procesando: '{user_message[:50]}...' (usuario {user_id})")
+            # Sin autoflush: las consultas del procesamiento no emiten UPDATEs intermedios de la conversación
+            with self.db.no_autoflush:
+                logger.debug("📨 [%s] Procesando: '%s...' (usuario %s)", self.request_count, user_message[:50], user_id)
             
-            # ✅ 1. OBTENER O CREAR CONVERSACIÓN LIMPIA
-            conversation = self._get_or_create_clean_conversation(conversation_id, user_id)
+                # ✅ 1. OBTENER O CREAR CONVERSACIÓN LIMPIA
+                conversation = self._get_or_create_clean_conversation(conversation_id, user_id)
             
-            # ✅ 2. VERIFICAR SI NECESITA RESET COMPLETO
-            if self._should_reset_conversation(conversation, user_message):
-                conversation = self._reset_conversation_completely(conversation)
+                # ✅ 2. VERIFICAR SI NECESITA RESET COMPLETO
+                if self._should_reset_conversation(conversation, user_message):
+                    conversation = self._reset_conversation_completely(conversation, commit=persistir)
             
-            # ✅ 3. OBTENER CONTEXTO DINÁMICO (SIN VALORES HARDCODEADOS)
-            contexto = self._get_dynamic_context(conversation, user_message)
+                # ✅ 3. OBTENER CONTEXTO DINÁMICO (SIN VALORES HARDCODEADOS)
+                contexto = self._get_dynamic_context(conversation, user_message)
             
-            logger.info(f"💬 Conv {conversation.id} - Estado: {conversation.current_state}")
-            logger.info(f"📋 Contexto: {len(contexto)} elementos")
+                logger.debug("💬 Conv %s - Estado: %s", conversation.id, conversation.current_state)
+                logger.debug("📋 Contexto: %s elementos", len(contexto))
             
-            # ✅ 4. PROCESAR MENSAJE 100% DINÁMICO
-            resultado = await self._process_message_dynamic(conversation, user_message, contexto)
+                # ✅ 4. PROCESAR MENSAJE 100% DINÁMICO
+                resultado = self._process_message_dynamic(conversation, user_message, contexto)
             
-            # ✅ 5. ACTUALIZAR CONVERSACIÓN
-            conversation.current_state = resultado.get("new_state", conversation.current_state)
-            conversation.updated_at = datetime.now()
+                # ✅ 5. ACTUALIZAR CONVERSACIÓN
+                conversation.current_state = resultado.get("new_state", conversation.current_state)
+                conversation.updated_at = now
             
-            # ✅ 6. GUARDAR CONTEXTO DINÁMICO
-            if resultado.get("context_updates"):
-                self._update_context_dynamic(conversation, resultado["context_updates"])
+                # ✅ 6. GUARDAR CONTEXTO DINÁMICO
+                if resultado.get("context_updates"):
+                    self._update_context_dynamic(conversation, resultado["context_updates"])
             
-            self.db.commit()
+                if persistir:
+                    self.db.commit()
             
-            execution_time = (time.time() - start_time) * 1000
-            logger.info(f"✅ Respuesta generada en {execution_time:.1f}ms")
+                execution_time = (time.time() - start_time) * 1000
+                logger.debug("✅ Respuesta generada en %.1fms", execution_time)
             
-            return {
-                "response": resultado.get("message", "Procesando..."),
-                "conversation_id": conversation_id,
-                "state": conversation.current_state,
-                "context": self._get_context_dict(conversation),
-                "buttons": resultado.get("buttons", []),
-                "session_valid": True,
-                "execution_time_ms": execution_time
-            }
+                return {
+                    "response": resultado.get("message", "Procesando..."),
+                    "conversation_id": conversation_id,
+                    "state": conversation.current_state,
+                    "context": self._get_context_dict(conversation),
+                    "buttons": resultado.get("buttons", []),
+                    "session_valid": True,
+                    "execution_time_ms": execution_time
+                }
             
         except Exception as e:
             logger.error(f"❌ Error procesando mensaje: {e}")
+            if not persistir:
+                self.db.rollback()
             return self._error_response(conversation_id, user_id)
 
+    def procesar_mensaje_prueba(self, user_message: str, contexto: Dict[str, Any], estado: str) -> Dict[str, Any]:
+        """
+        Procesa un mensaje desde un estado y contexto dados sin leer ni escribir conversaciones
+        (endpoints de prueba): la conversación es transitoria y nunca se agrega a la sesión.
+        """
+        conversation = Conversation(current_state=estado, context_data=dict(contexto or {}))
+        contexto_turno = self._get_dynamic_context(conversation, user_message)
+        resultado = self._process_message_dynamic(conversation, user_message, contexto_turno)
+        
+        return {
+            "next_state": resultado.get("new_state", estado),
+            "contexto_actualizado": {**contexto_turno, **resultado.get("context_updates", {})},
+            "mensaje_respuesta": resultado.get("message", ""),
+            "botones": resultado.get("buttons", []),
+            "metodo": resultado.get("method"),
+            "success": resultado.get("method") != "error_fallback"
+        }
+
     def _get_or_create_clean_conversation(self, conversation_id: int, user_id: int) -> Conversation:
         """✅ CORREGIDO - Crear conversación completamente limpia"""
         try:
@@ -96,14 +316,15 @@ class ConversationService:
             
             if not conversation:
                 # ✅ CREAR NUEVA CONVERSACIÓN COMPLETAMENTE LIMPIA
+                ahora = datetime.now()
                 conversation = Conversation(
                     id=conversation_id,
                     user_id=user_id,
                     current_state="inicial",  # ✅ SIEMPRE INICIAL
-                    context_data="{}",  # ✅ CONTEXTO COMPLETAMENTE VACÍO
+                    context_data={},  # ✅ CONTEXTO COMPLETAMENTE VACÍO
                     is_active=True,
-                    created_at=datetime.now(),
-                    updated_at=datetime.now()
+                    created_at=ahora,
+                    updated_at=ahora
                 )
                 self.db.add(conversation)
                 self.db.commit()
@@ -138,14 +359,14 @@ class ConversationService:
         
         return False
     
-    def _reset_conversation_completely(self, conversation: Conversation) -> Conversation:
+    def _reset_conversation_completely(self, conversation: Conversation, commit: bool = True) -> Conversation:
         """✅ NUEVO - Reset completo de conversación"""
         try:
             logger.info(f"🔄 Reseteando conversación {conversation.id} completamente")
             
             # ✅ RESET COMPLETO
             conversation.current_state = "inicial"
-            conversation.context_data = "{}"  # ✅ CONTEXTO COMPLETAMENTE VACÍO
+            conversation.context_data = {}  # ✅ CONTEXTO COMPLETAMENTE VACÍO
             conversation.is_active = True
             conversation.updated_at = datetime.now()
             
@@ -153,7 +374,8 @@ class ConversationService:
             if conversation.id in self.session_cache:
                 del self.session_cache[conversation.id]
             
-            self.db.commit()
+            if commit:
+                self.db.commit()
             logger.info(f"✅ Conversación reseteada completamente")
             
             return conversation
@@ -169,29 +391,26 @@ class ConversationService:
             contexto = {}
             
             # ✅ 2. SOLO RECUPERAR SI HAY DATOS REALES EN BD
-            if hasattr(conversation, 'context_data') and conversation.context_data:
-                try:
-                    if conversation.context_data != "{}":
-                        context_from_db = json.loads(conversation.context_data)
-                        if isinstance(context_from_db, dict) and context_from_db:
-                            # ✅ SOLO USAR SI TIENE DATOS REALES DEL CLIENTE
-                            if context_from_db.get('cliente_encontrado') and context_from_db.get('saldo_total', 0) > 1000:
-                                contexto = context_from_db
-                                logger.info(f"✅ Contexto real recuperado: {contexto.get('Nombre_del_cliente')}")
-                            else:
-                                logger.info(f"🔄 Contexto sin datos reales - iniciando limpio")
-                except json.JSONDecodeError:
-                    logger.warning(f"⚠️ Error parseando contexto - iniciando limpio")
+            # (la columna JSON ya entrega un dict deserializado)
+            context_from_db = conversation.context_data
+            if isinstance(context_from_db, dict) and context_from_db:
+                # ✅ SOLO USAR SI TIENE DATOS REALES DEL CLIENTE
+                if context_from_db.get('cliente_encontrado') and context_from_db.get('saldo_total', 0) > 1000:
+                    # Copia: el contexto de trabajo no debe modificar en sitio el dict cargado
+                    contexto = dict(context_from_db)
+                    logger.debug("✅ Contexto real recuperado: %s", contexto.get('Nombre_del_cliente'))
+                else:
+                    logger.debug("🔄 Contexto sin datos reales - iniciando limpio")
             
             # ✅ 3. DETECTAR CÉDULA EN MENSAJE ACTUAL
             cedula_detectada = self._extract_cedula_simple(user_message)
             if cedula_detectada:
-                logger.info(f"🎯 Cédula detectada en mensaje: {cedula_detectada}")
+                logger.debug("🎯 Cédula detectada en mensaje: %s", cedula_detectada)
                 # ✅ CONSULTAR DATOS REALES INMEDIATAMENTE
                 cliente_data = self._query_client_real_data(cedula_detectada)
                 if cliente_data.get("encontrado"):
                     contexto.update(cliente_data)
-                    logger.info(f"✅ Datos reales del cliente agregados")
+                    logger.debug("✅ Datos reales del cliente agregados")
             
             # ✅ 4. SIN VALORES POR DEFECTO HARDCODEADOS
             # Si no hay datos reales, el contexto queda vacío
@@ -203,20 +422,15 @@ class ConversationService:
             return {}
     
     def _query_client_real_data(self, cedula: str) -> Dict[str, Any]:
-        """✅ NUEVO - Consultar SOLO datos reales, sin fallbacks hardcodeados"""
+        """✅ NUEVO - Consultar SOLO datos reales, sin fallbacks hardcodeados (cache LRU con TTL)"""
+        cedula = str(cedula)
+        cacheado = _cliente_cache_get(cedula)
+        if cacheado is not None:
+            logger.debug(f"⚡ Cliente desde cache: {cedula}")
+            return cacheado
+        
         try:
-            query = text("""
-                SELECT TOP 1 
-                    Nombre_del_cliente, Saldo_total, banco,
-                    Oferta_1, Oferta_2, 
-                    Hasta_3_cuotas, Hasta_6_cuotas, Hasta_12_cuotas,
-                    Producto, Telefono, Email
-                FROM ConsolidadoCampañasNatalia 
-                WHERE CAST(Cedula AS VARCHAR) = :cedula
-                ORDER BY Saldo_total DESC
-            """)
-            
-            result = self.db.execute(query, {"cedula": str(cedula)}).fetchone()
+            result = self.db.execute(_CLIENTE_REAL_QUERY, {"cedula": cedula}).fetchone()
             
             if result:
                 # ✅ SOLO DEVOLVER DATOS REALES - SIN VALORES POR DEFECTO
@@ -240,19 +454,22 @@ class ConversationService:
                     "consulta_timestamp": datetime.now().isoformat()
                 }
                 
-                logger.info(f"✅ Cliente real encontrado: {datos_reales['Nombre_del_cliente']}")
-                logger.info(f"💰 Saldo real: ${datos_reales['saldo_total']:,}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("✅ Cliente real encontrado: %s", datos_reales['Nombre_del_cliente'])
+                    logger.debug("💰 Saldo real: $%s", f"{datos_reales['saldo_total']:,}")
                 
+                _cliente_cache_set(cedula, datos_reales)
                 return datos_reales
             
-            logger.info(f"❌ Cliente no encontrado para cédula: {cedula}")
+            logger.debug("❌ Cliente no encontrado para cédula: %s", cedula)
+            _cliente_cache_set(cedula, {"encontrado": False}, ttl=_CLIENTE_NO_ENCONTRADO_TTL)
             return {"encontrado": False}
             
         except Exception as e:
             logger.error(f"❌ Error consultando cliente real: {e}")
             return {"encontrado": False}
     
-    async def _process_message_dynamic(self, conversation: Conversation, user_message: str, contexto: Dict) -> Dict:
+    def _process_message_dynamic(self, conversation: Conversation, user_message: str, contexto: Dict) -> Dict:
         """✅ PROCESAMIENTO 100% DINÁMICO SIN HARDCODING"""
         try:
             start_time = time.time()
@@ -261,7 +478,7 @@ class ConversationService:
             cedula_detectada = self._extract_cedula_simple(user_message)
             
             if cedula_detectada:
-                logger.info(f"🎯 Cédula detectada: {cedula_detectada}")
+                logger.debug("🎯 Cédula detectada: %s", cedula_detectada)
                 
                 # Consultar cliente real
                 cliente_info = self._query_client_real_data(cedula_detectada)
@@ -300,14 +517,14 @@ class ConversationService:
             # ✅ 2. CLASIFICACIÓN ML + SISTEMA DINÁMICO
             ml_result = {}
             if self.ml_service:
-                ml_prediction = self.ml_service.predict(user_message)
+                ml_prediction = self._ml_predict(user_message)
                 ml_result = {
                     'intention': ml_prediction.get('intention', 'DESCONOCIDA'),
                     'confidence': ml_prediction.get('confidence', 0.0),
                     'method': 'ml_classification'
                 }
                 
-                logger.info(f"🤖 ML: {ml_result['intention']} (confianza: {ml_result['confidence']:.2f})")
+                logger.debug("🤖 ML: %s (confianza: %.2f)", ml_result['intention'], ml_result['confidence'])
             
             # ✅ 3. USAR SISTEMA DINÁMICO PARA DETERMINAR TRANSICIÓN
             transition_result = self.dynamic_transition_service.determine_next_state(
@@ -323,7 +540,7 @@ class ConversationService:
             )
             
             execution_time = (time.time() - start_time) * 1000
-            logger.info(f"✅ Procesamiento dinámico completado en {execution_time:.1f}ms")
+            logger.debug("✅ Procesamiento dinámico completado en %.1fms", execution_time)
             
             return {
                 "new_state": transition_result["next_state"],
@@ -347,23 +564,16 @@ class ConversationService:
     def _generate_response_dynamic(self, estado: str, contexto: Dict[str, Any]) -> str:
         """✅ GENERAR RESPUESTA 100% DINÁMICA DESDE BD"""
         try:
-            # ✅ OBTENER TEMPLATE DESDE BD
-            query = text("""
-                SELECT mensaje_template 
-                FROM Estados_Conversacion 
-                WHERE nombre = :estado AND activo = 1
-            """)
-            
-            result = self.db.execute(query, {"estado": estado}).fetchone()
-            
-            if result and result[0]:
-                template = result[0]
-                logger.info(f"✅ Template dinámico obtenido para estado '{estado}'")
+            # ✅ OBTENER TEMPLATE DESDE BD (cacheado por proceso)
+            template = obtener_template_estado(self.db, estado)
+            
+            if template:
+                logger.debug("✅ Template dinámico obtenido para estado '%s'", estado)
                 
                 # ✅ RESOLVER VARIABLES DINÁMICAMENTE
                 try:
                     mensaje_final = self.variable_service.resolver_variables(template, contexto)
-                    logger.info(f"✅ Variables resueltas dinámicamente")
+                    logger.debug("✅ Variables resueltas dinámicamente")
                     return mensaje_final
                 except Exception as e:
                     logger.error(f"⚠️ Error resolviendo variables: {e}")
@@ -382,71 +592,30 @@ class ConversationService:
             return "¿En qué puedo ayudarte?"
     
     def _get_buttons_dynamic(self, estado: str, contexto: Dict) -> List[Dict]:
-        """✅ BOTONES COMPLETAMENTE DINÁMICOS"""
+        """✅ BOTONES COMPLETAMENTE DINÁMICOS (tabla precalculada por estado y cliente)"""
         try:
             # ✅ OBTENER BOTONES DESDE BD (implementar tabla de botones)
             # Por ahora, lógica dinámica básica
-            
-            tiene_cliente = contexto.get('cliente_encontrado', False)
-            
-            if estado == "informar_deuda" and tiene_cliente:
-                return [
-                    {"id": "si_opciones", "text": "Sí, quiero ver opciones"},
-                    {"id": "no_ahora", "text": "No por ahora"}
-                ]
-            elif estado == "proponer_planes_pago" and tiene_cliente:
-                return [
-                    {"id": "pago_unico", "text": "Pago único"},
-                    {"id": "plan_3_cuotas", "text": "3 cuotas"},
-                    {"id": "plan_6_cuotas", "text": "6 cuotas"},
-                    {"id": "plan_12_cuotas", "text": "12 cuotas"}
-                ]
-            elif estado == "generar_acuerdo":
-                return [
-                    {"id": "confirmar", "text": "Confirmar acuerdo"},
-                    {"id": "modificar", "text": "Modificar términos"}
-                ]
-            else:
-                return [{"id": "ayuda", "text": "Necesito ayuda"}]
+            clave = (estado, bool(contexto.get('cliente_encontrado', False)))
+            return list(_BOTONES_POR_ESTADO.get(clave, _BOTONES_AYUDA))
                 
         except Exception as e:
             logger.error(f"❌ Error generando botones dinámicos: {e}")
             return []
     
     def _extract_cedula_simple(self, mensaje: str) -> Optional[str]:
-        """Extracción simple de cédula"""
-        patterns = [
-            r'\b(\d{7,12})\b',
-            r'cedula\s*:?\s*(\d{7,12})',
-            r'documento\s*:?\s*(\d{7,12})',
-            r'cc\s*:?\s*(\d{7,12})'
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, mensaje, re.IGNORECASE)
-            for match in matches:
-                if 7 <= len(match) <= 12 and len(set(match)) > 1:
-                    return match
-        return None
+        """Extracción simple de cédula (número aislado primero, luego precedido de palabra clave)"""
+        return _extraer_cedula(mensaje) if mensaje else None
     
     def _update_context_dynamic(self, conversation: Conversation, updates: Dict):
         """✅ ACTUALIZAR CONTEXTO SIN VALORES HARDCODEADOS"""
         try:
-            current_context = {}
-            if hasattr(conversation, 'context_data') and conversation.context_data:
-                try:
-                    current_context = json.loads(conversation.context_data)
-                except:
-                    pass
+            current_context = self._get_context_dict(conversation)
             
-            # ✅ COMBINAR SOLO DATOS REALES
-            updated_context = {**current_context, **updates}
+            # ✅ COMBINAR SOLO DATOS REALES (la columna JSON serializa al guardar)
+            conversation.context_data = {**current_context, **updates}
             
-            # ✅ SERIALIZACIÓN SEGURA
-            context_json = json.dumps(updated_context, ensure_ascii=False, default=str)
-            conversation.context_data = context_json
-            
-            logger.info(f"💾 Contexto actualizado dinámicamente")
+            logger.debug("💾 Contexto actualizado dinámicamente")
             
         except Exception as e:
             logger.error(f"❌ Error actualizando contexto: {e}")
@@ -454,9 +623,8 @@ class ConversationService:
     def _get_context_dict(self, conversation: Conversation) -> Dict:
         """Obtener contexto como diccionario"""
         try:
-            if hasattr(conversation, 'context_data') and conversation.context_data:
-                return json.loads(conversation.context_data)
-            return {}
+            contexto = conversation.context_data
+            return contexto if isinstance(contexto, dict) else {}
         except:
             return {}
     
@@ -473,6 +641,4 @@ class ConversationService:
 
 def crear_conversation_service(db: Session) -> ConversationService:
     """Factory para crear instancia del servicio dinámico corregido"""
-    service = ConversationService(db)
-    logger.info("✅ ConversationService corregido creado - 100% dinámico")
-    return service
\ No newline at end of file
+    return ConversationService(db)
\ No newline at end of file
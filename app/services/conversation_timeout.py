@@ -149,7 +149,7 @@ class ConversationTimeoutManager:
             try:
                 if hasattr(conversation, 'context_data') and conversation.context_data:
                     try:
-                        context = json.loads(conversation.context_data) if isinstance(conversation.context_data, str) else conversation.context_data
+                        context = json.loads(conversation.context_data) if isinstance(conversation.context_data, str) else dict(conversation.context_data)
                     except:
                         context = {}
                 else:
@@ -163,7 +163,7 @@ class ConversationTimeoutManager:
                 })
                 
                 if hasattr(conversation, 'context_data'):
-                    conversation.context_data = json.dumps(context, ensure_ascii=False, default=str)
+                    conversation.context_data = context
                 
             except Exception as e:
                 logger.warning(f"⚠️ Error actualizando contexto en cierre: {e}")
@@ -10,6 +10,44 @@ from app.models.condiciones_inteligentes import CondicionesInteligentes
 
 logger = logging.getLogger(__name__)
 
+# ✅ CONSULTAS DE LA TABLA DE TRANSICIONES (se cargan una vez por TTL, no en cada mensaje)
+_ESTADOS_TRANSICION_QUERY = text("""
+    SELECT nombre, estado_siguiente_true, estado_siguiente_false, estado_siguiente_default, condicion
+    FROM Estados_Conversacion 
+    WHERE activo = 1
+""")
+
+_ESTADO_TRANSICION_QUERY = text("""
+    SELECT estado_siguiente_true, estado_siguiente_false, estado_siguiente_default, condicion
+    FROM Estados_Conversacion 
+    WHERE nombre = :estado AND activo = 1
+""")
+
+_EQUIVALENCIAS_QUERY = text("""
+    SELECT base_condition, pattern_variations
+    FROM condition_equivalences
+    WHERE active = 1
+""")
+
+_EQUIVALENCIA_QUERY = text("""
+    SELECT pattern_variations
+    FROM condition_equivalences
+    WHERE base_condition = :base_condition AND active = 1
+""")
+
+# Umbral con el que keyword_condition_patterns sirve de fallback de transición
+_CONFIANZA_FALLBACK_KEYWORD = 0.7
+
+# ✅ SELECCIÓN DE PLAN EN proponer_planes_pago: (condición, patrones, etiqueta) en orden de prioridad
+_PATRONES_SELECCION_PLAN = (
+    ('cliente_selecciona_pago_unico',
+     ('pago unic', 'pago único', 'descuento', 'oferta especial',
+      'liquidar', 'pago completo', 'primera', 'primer', '1'), None),
+    ('cliente_selecciona_plan_3_cuotas', ('3 cuotas', 'tres cuotas', 'segunda', '2'), '3_cuotas'),
+    ('cliente_selecciona_plan_6_cuotas', ('6 cuotas', 'seis cuotas', 'tercera', '3'), '6_cuotas'),
+    ('cliente_selecciona_plan_12_cuotas', ('12 cuotas', 'doce cuotas', 'cuarta', '4'), '12_cuotas'),
+)
+
 class DynamicTransitionService:
     """
     🎯 SERVICIO DE TRANSICIONES 100% DINÁMICO
@@ -23,6 +61,11 @@ class DynamicTransitionService:
         self.ml_mappings = {}
         self.keyword_patterns = {}
         self.condition_evaluators = {}
+        # Tabla de transiciones compilada: estado → (true, false, default, condición requerida)
+        self.transiciones_estado = None
+        self.equivalencias = None
+        self.sorted_keyword_patterns = []
+        self.condiciones_fallback = frozenset()
         self.cache_timestamp = 0
         self.cache_ttl = 300  
         
@@ -43,6 +86,10 @@ class DynamicTransitionService:
             # 3. Cargar evaluadores de condición
             self._load_condition_evaluators()
             
+            # 4. Compilar tabla de transiciones y equivalencias
+            self._load_transition_table()
+            self._compile_lookup_tables()
+            
             self.cache_timestamp = time.time()
             
             load_time = (time.time() - start_time) * 1000
@@ -50,6 +97,7 @@ class DynamicTransitionService:
             logger.info(f"   ML mappings: {len(self.ml_mappings)}")
             logger.info(f"   Keyword patterns: {len(self.keyword_patterns)}")
             logger.info(f"   Condition evaluators: {len(self.condition_evaluators)}")
+            logger.info(f"   Estados con transición: {len(self.transiciones_estado or {})}")
             
         except Exception as e:
             logger.error(f"❌ Error cargando configuración: {e}")
@@ -124,16 +172,73 @@ class DynamicTransitionService:
             
             self.condition_evaluators = {}
             for row in self.db.execute(query):
+                config = json.loads(row[2]) if row[2] else {}
+                # keyword_match: palabras en minúsculas una sola vez al cargar (solo con config dict;
+                # un config_json lista/texto no debe tumbar la carga de toda la tabla)
+                keywords_lower = None
+                if row[1] == 'keyword_match' and isinstance(config, dict):
+                    keywords_lower = tuple(kw.lower() for kw in config.get('keywords', ()) if isinstance(kw, str))
                 self.condition_evaluators[row[0]] = {
                     'method': row[1],
-                    'config': json.loads(row[2]) if row[2] else {},
-                    'threshold': row[3]
+                    'config': config,
+                    'threshold': row[3],
+                    'keywords_lower': keywords_lower
                 }
                 
         except Exception as e:
             logger.warning(f"⚠️ Error cargando evaluadores: {e}")
             self.condition_evaluators = {}
     
+    def _load_transition_table(self):
+        """Cargar Estados_Conversacion y condition_equivalences completos en memoria"""
+        try:
+            self.transiciones_estado = {
+                row[0]: (row[1], row[2], row[3], row[4])
+                for row in self.db.execute(_ESTADOS_TRANSICION_QUERY)
+            }
+        except Exception as e:
+            logger.warning(f"⚠️ Error cargando tabla de transiciones: {e}")
+            self.transiciones_estado = None  # se consulta la BD por mensaje
+        
+        try:
+            equivalencias = {}
+            for base_condition, variaciones in self.db.execute(_EQUIVALENCIAS_QUERY):
+                if not variaciones:
+                    continue
+                try:
+                    lista = json.loads(variaciones)
+                except (ValueError, TypeError):
+                    continue
+                if isinstance(lista, list):
+                    equivalencias.setdefault(base_condition, set()).update(lista)
+            self.equivalencias = {k: frozenset(v) for k, v in equivalencias.items()}
+        except Exception as e:
+            # Tabla opcional: sin ella solo aplica el mapeo básico (se reintenta al vencer el TTL)
+            logger.warning(f"⚠️ Error cargando equivalencias: {e}")
+            self.equivalencias = {}
+    
+    def _compile_lookup_tables(self):
+        """Derivar de la configuración cargada las estructuras que se recorren en cada mensaje"""
+        self.sorted_keyword_patterns = []
+        for pattern, pattern_info in sorted(
+            self.keyword_patterns.items(),
+            key=lambda x: x[1]['confidence'],
+            reverse=True
+        ):
+            compilado = None
+            if pattern_info['pattern_type'] == 'regex':
+                try:
+                    compilado = re.compile(pattern)
+                except re.error:
+                    continue  # un regex inválido nunca coincide
+            self.sorted_keyword_patterns.append((pattern, pattern_info, compilado))
+        
+        self.condiciones_fallback = frozenset(
+            [info['bd_condition'] for info in self.keyword_patterns.values()
+             if (info['confidence'] or 0) >= _CONFIANZA_FALLBACK_KEYWORD] +
+            [info['bd_condition'] for info in self.ml_mappings.values()]
+        )
+    
     def _load_emergency_fallback(self):
         """Fallback mínimo en caso de error de BD"""
         logger.warning("🚨 Usando configuración de emergencia")
@@ -147,6 +252,10 @@ class DynamicTransitionService:
             'acepto': {'bd_condition': 'cliente_selecciona_plan', 'confidence': 0.9, 'requires_client': True, 'state_context': None, 'pattern_type': 'contains'},
             'si': {'bd_condition': 'cliente_confirma_interes', 'confidence': 0.8, 'requires_client': False, 'state_context': None, 'pattern_type': 'contains'}
         }
+        
+        self.transiciones_estado = None
+        self.equivalencias = None
+        self._compile_lookup_tables()
     
     def determine_next_state(self, current_state: str, user_message: str, 
                         ml_result: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
@@ -157,7 +266,10 @@ class DynamicTransitionService:
         if time.time() - self.cache_timestamp > self.cache_ttl:
             self._load_configuration()
         
-        logger.info(f"🎯 Determinando transición: {current_state} + '{user_message[:30]}...'")
+        logger.debug("🎯 Determinando transición: %s + '%s...'", current_state, user_message[:30])
+        
+        # Normalización única del mensaje para patrones y evaluadores
+        message_lower = user_message.lower()
         
         # 1. ✅ PRIORIDAD 1: MAPEO ML → BD
         ml_result_dict = self._try_ml_mapping(ml_result, context)
@@ -168,7 +280,7 @@ class DynamicTransitionService:
                 return self._build_result(next_state, ml_result_dict, 'ml_mapping', execution_time)
         
         # 2. ✅ PRIORIDAD 2: PATRONES DE PALABRAS CLAVE - CORREGIDO
-        keyword_result = self._try_keyword_patterns(user_message, current_state, context)
+        keyword_result = self._try_keyword_patterns(user_message, current_state, context, message_lower)
         if keyword_result['success']:
             next_state = self._get_next_state_from_bd(current_state, keyword_result['condition'], usar_inteligentes=True)  # ✅ FIX
             if next_state != current_state:
@@ -176,7 +288,7 @@ class DynamicTransitionService:
                 return self._build_result(next_state, keyword_result, 'keyword_pattern', execution_time)
         
         # 3. ✅ PRIORIDAD 3: EVALUADORES PERSONALIZADOS - CORREGIDO
-        evaluator_result = self._try_condition_evaluators(user_message, context)
+        evaluator_result = self._try_condition_evaluators(user_message, context, message_lower)
         if evaluator_result['success']:
             next_state = self._get_next_state_from_bd(current_state, evaluator_result['condition'], usar_inteligentes=True)  # ✅ FIX
             if next_state != current_state:
@@ -213,77 +325,40 @@ class DynamicTransitionService:
             'source': 'ml_mapping'
         }
     
-    def _try_keyword_patterns(self, message: str, current_state: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    def _try_keyword_patterns(self, message: str, current_state: str, context: Dict[str, Any],
+                              message_lower: Optional[str] = None) -> Dict[str, Any]:
         """✅ CORREGIDO - Pattern matching robusto con case insensitive"""
         
-        message_lower = message.lower().strip()  # ✅ SIEMPRE lowercase
+        message_lower = (message.lower() if message_lower is None else message_lower).strip()  # ✅ SIEMPRE lowercase
         has_client = context.get('cliente_encontrado', False)
         
-        # ✅ DETECCIÓN ESPECÍFICA PARA SELECCIÓN DE PLANES (PRIORIDAD MÁXIMA)
+        # ✅ DETECCIÓN ESPECÍFICA PARA SELECCIÓN DE PLANES (PRIORIDAD MÁXIMA, solo en ese estado)
         if current_state == 'proponer_planes_pago':
-            
-            # ✅ PAGO ÚNICO - Patrones amplios
-            pago_unico_patterns = [
-                'pago unic', 'pago único', 'descuento', 'oferta especial',
-                'liquidar', 'pago completo', 'primera', 'primer', '1'
-            ]
-            
-            if any(pattern in message_lower for pattern in pago_unico_patterns):
-                return {
-                    'success': True,
-                    'condition': 'cliente_selecciona_pago_unico',
-                    'confidence': 0.95,
-                    'pattern_matched': f'pago_unico_detected: {message_lower}',
-                    'source': 'keyword_pattern_plan_selection'
-                }
-            
-            # ✅ 3 CUOTAS
-            if any(pattern in message_lower for pattern in ['3 cuotas', 'tres cuotas', 'segunda', '2']):
-                return {
-                    'success': True,
-                    'condition': 'cliente_selecciona_plan_3_cuotas',
-                    'confidence': 0.95,
-                    'pattern_matched': '3_cuotas',
-                    'source': 'keyword_pattern_plan_selection'
-                }
-            
-            # ✅ 6 CUOTAS  
-            if any(pattern in message_lower for pattern in ['6 cuotas', 'seis cuotas', 'tercera', '3']):
-                return {
-                    'success': True,
-                    'condition': 'cliente_selecciona_plan_6_cuotas',
-                    'confidence': 0.95,
-                    'pattern_matched': '6_cuotas',
-                    'source': 'keyword_pattern_plan_selection'
-                }
-            
-            # ✅ 12 CUOTAS
-            if any(pattern in message_lower for pattern in ['12 cuotas', 'doce cuotas', 'cuarta', '4']):
-                return {
-                    'success': True,
-                    'condition': 'cliente_selecciona_plan_12_cuotas', 
-                    'confidence': 0.95,
-                    'pattern_matched': '12_cuotas',
-                    'source': 'keyword_pattern_plan_selection'
-                }
-        
-        # ✅ RESTO DEL CÓDIGO ORIGINAL (búsqueda en BD)
-        sorted_patterns = sorted(
-            self.keyword_patterns.items(), 
-            key=lambda x: x[1]['confidence'], 
-            reverse=True
-        )
-        
-        for pattern, pattern_info in sorted_patterns:
-            if not self._pattern_matches(pattern, message_lower, pattern_info['pattern_type']):
-                continue
-            
+            for condicion, patrones, etiqueta in _PATRONES_SELECCION_PLAN:
+                if any(pattern in message_lower for pattern in patrones):
+                    return {
+                        'success': True,
+                        'condition': condicion,
+                        'confidence': 0.95,
+                        'pattern_matched': etiqueta or f'pago_unico_detected: {message_lower}',
+                        'source': 'keyword_pattern_plan_selection'
+                    }
+        
+        # ✅ RESTO DEL CÓDIGO ORIGINAL (patrones de BD, ya ordenados y compilados al cargar)
+        for pattern, pattern_info, compilado in self.sorted_keyword_patterns:
+            # Filtros baratos (estado y cliente) antes de recorrer el texto
             if pattern_info['state_context'] and pattern_info['state_context'] != current_state:
                 continue
             
             if pattern_info['requires_client'] and not has_client:
                 continue
             
+            if compilado is not None:
+                if not compilado.search(message_lower):
+                    continue
+            elif not self._pattern_matches(pattern, message_lower, pattern_info['pattern_type']):
+                continue
+            
             logger.info(f"✅ Keyword match: '{pattern}' → {pattern_info['bd_condition']} ({pattern_info['confidence']:.2f})")
             
             return {
@@ -309,12 +384,15 @@ class DynamicTransitionService:
         else:  # 'contains' (default)
             return pattern in message
     
-    def _try_condition_evaluators(self, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    def _try_condition_evaluators(self, message: str, context: Dict[str, Any],
+                                  message_lower: Optional[str] = None) -> Dict[str, Any]:
         """Intentar evaluadores de condición personalizados"""
         
+        if message_lower is None:
+            message_lower = message.lower()  # una vez por mensaje, no por palabra clave
         for condition_name, evaluator in self.condition_evaluators.items():
             
-            if self._evaluate_condition_custom(condition_name, message, context, evaluator):
+            if self._evaluate_condition_custom(condition_name, message, context, evaluator, message_lower):
                 logger.info(f"✅ Custom evaluator: {condition_name}")
                 
                 return {
@@ -328,7 +406,8 @@ class DynamicTransitionService:
         return {'success': False, 'reason': 'no_evaluator_match'}
     
     def _evaluate_condition_custom(self, condition_name: str, message: str, 
-                                 context: Dict[str, Any], evaluator: Dict[str, Any]) -> bool:
+                                 context: Dict[str, Any], evaluator: Dict[str, Any],
+                                 message_lower: Optional[str] = None) -> bool:
         """Evaluar condición usando evaluador personalizado"""
         
         method = evaluator['method']
@@ -341,10 +420,14 @@ class DynamicTransitionService:
                 return bool(re.search(pattern, message))
             
             elif method == 'keyword_match':
-                keywords = config.get('keywords', [])
+                keywords = evaluator.get('keywords_lower')
+                if keywords is None:
+                    keywords = [kw.lower() for kw in config.get('keywords', [])]
+                if message_lower is None:
+                    message_lower = message.lower()
                 min_confidence = config.get('min_confidence', 0.7)
                 
-                matches = sum(1 for kw in keywords if kw.lower() in message.lower())
+                matches = sum(1 for kw in keywords if kw in message_lower)
                 confidence = matches / len(keywords) if keywords else 0
                 
                 return confidence >= min_confidence
@@ -375,14 +458,11 @@ class DynamicTransitionService:
         try:
             logger.info(f"🔍 [BD] Consultando transición: {estado_actual} + {condicion_detectada}")
             
-            # ✅ 1. PRIORIDAD: Estados_Conversacion (tabla principal)
-            query = text("""
-                SELECT estado_siguiente_true, estado_siguiente_false, estado_siguiente_default, condicion
-                FROM Estados_Conversacion 
-                WHERE nombre = :estado AND activo = 1
-            """)
-            
-            result = self.db.execute(query, {"estado": estado_actual}).fetchone()
+            # ✅ 1. PRIORIDAD: Estados_Conversacion (tabla principal, compilada en memoria)
+            if self.transiciones_estado is not None:
+                result = self.transiciones_estado.get(estado_actual)
+            else:
+                result = self.db.execute(_ESTADO_TRANSICION_QUERY, {"estado": estado_actual}).fetchone()
             
             if result:
                 estado_true, estado_false, estado_default, condicion_requerida = result
@@ -399,38 +479,12 @@ class DynamicTransitionService:
                     logger.info(f"🔄 [BD] Usando default: {estado_actual} → {estado_default}")
                     return estado_default
             
-            # ✅ 2. FALLBACK: keyword_condition_patterns
-            keyword_query = text("""
-                SELECT bd_condition, confidence_score
-                FROM keyword_condition_patterns 
-                WHERE active = 1 AND confidence_score >= 0.7
-                ORDER BY confidence_score DESC
-            """)
-            
-            for row in self.db.execute(keyword_query):
-                bd_condition, confidence = row
-                if bd_condition == condicion_detectada:
-                    # Buscar estado destino para esta condición
-                    destino = self._buscar_estado_destino_para_condicion(bd_condition, estado_actual)
-                    if destino != estado_actual:
-                        logger.info(f"✅ [KEYWORD] Encontrado: {estado_actual} → {destino}")
-                        return destino
-            
-            # ✅ 3. ÚLTIMO RECURSO: ml_intention_mappings
-            ml_query = text("""
-                SELECT bd_condition, confidence_threshold
-                FROM ml_intention_mappings
-                WHERE active = 1
-                ORDER BY priority ASC
-            """)
-            
-            for row in self.db.execute(ml_query):
-                bd_condition, threshold = row
-                if bd_condition == condicion_detectada:
-                    destino = self._buscar_estado_destino_para_condicion(bd_condition, estado_actual)
-                    if destino != estado_actual:
-                        logger.info(f"✅ [ML] Encontrado: {estado_actual} → {destino}")
-                        return destino
+            # ✅ 2. FALLBACK: condición conocida por keyword_condition_patterns o ml_intention_mappings
+            if condicion_detectada in self.condiciones_fallback:
+                destino = self._buscar_estado_destino_para_condicion(condicion_detectada, estado_actual)
+                if destino != estado_actual:
+                    logger.info(f"✅ [FALLBACK] Encontrado: {estado_actual} → {destino}")
+                    return destino
             
             logger.info(f"🌀 [BD] Sin transición definida, permaneciendo en: {estado_actual}")
             return estado_actual
@@ -449,26 +503,23 @@ class DynamicTransitionService:
         if condicion_requerida == condicion_detectada:
             return True
         
-        # ✅ CONSULTAR TABLA DE EQUIVALENCIAS DINÁMICAS
-        try:
-            equivalencias_query = text("""
-                SELECT pattern_variations
-                FROM condition_equivalences
-                WHERE base_condition = :base_condition AND active = 1
-            """)
-            
-            result = self.db.execute(equivalencias_query, {"base_condition": condicion_requerida}).fetchone()
-            
-            if result and result[0]:
-                try:
-                    import json
-                    variaciones = json.loads(result[0])
-                    if condicion_detectada in variaciones:
-                        return True
-                except:
-                    pass
-        except:
-            pass
+        # ✅ TABLA DE EQUIVALENCIAS DINÁMICAS (en memoria; BD solo si no se pudo cargar)
+        if self.equivalencias is not None:
+            if condicion_detectada in self.equivalencias.get(condicion_requerida, ()):
+                return True
+        else:
+            try:
+                result = self.db.execute(_EQUIVALENCIA_QUERY, {"base_condition": condicion_requerida}).fetchone()
+                
+                if result and result[0]:
+                    try:
+                        variaciones = json.loads(result[0])
+                        if condicion_detectada in variaciones:
+                            return True
+                    except:
+                        pass
+            except:
+                pass
         
         # ✅ MAPEO DINÁMICO BÁSICO (sin hardcoding extenso)
         mapeo_basico = {
@@ -1,4 +1,5 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy import insert
 from sqlalchemy.exc import SQLAlchemyError
 from fastapi import HTTPException, status
 from typing import Optional, List
@@ -24,7 +25,8 @@ class LogService:
         button_selected: Optional[str] = None,
         previous_state: Optional[str] = None,
         next_state: Optional[str] = None,
-        metadata: Optional[str] = None  # ✅ AGREGADO - Parámetro metadata
+        metadata: Optional[str] = None,  # ✅ AGREGADO - Parámetro metadata
+        commit: bool = True
     ) -> Message:
         """
         Registra un mensaje en la conversación.
@@ -38,6 +40,8 @@ class LogService:
             previous_state: Estado anterior (opcional)
             next_state: Estado siguiente (opcional)
             metadata: Metadata adicional en formato JSON (opcional)
+            commit: Si es False, el mensaje solo se agrega a la sesión y se confirma
+                    con el commit del llamador (una transacción por petición)
         """
         # Verificar que la conversación existe
         conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
@@ -73,8 +77,9 @@ class LogService:
                     new_message.text_content = f"{text_content} [META: {metadata}]"
             
             db.add(new_message)
-            db.commit()
-            db.refresh(new_message)
+            if commit:
+                db.commit()
+                db.refresh(new_message)
             
             return new_message
             
@@ -91,8 +96,9 @@ class LogService:
                     timestamp=datetime.now()
                 )
                 db.add(basic_message)
-                db.commit()
-                db.refresh(basic_message)
+                if commit:
+                    db.commit()
+                    db.refresh(basic_message)
                 return basic_message
                 
             except Exception as fallback_error:
@@ -103,6 +109,41 @@ class LogService:
                     detail=f"Error crítico registrando mensaje: {str(fallback_error)}"
                 )
     
+    @staticmethod
+    def log_messages(
+        db: Session,
+        mensajes: List[Dict[str, Any]],
+        commit: bool = True
+    ) -> int:
+        """
+        Registra varios mensajes de una conversación en un solo INSERT (executemany).
+        
+        A diferencia de log_message no verifica la conversación ni recarga las filas:
+        es para el llamador que ya la tiene (p. ej. el par usuario/sistema de /message).
+        Cada mensaje es un dict con las columnas de Message; timestamp por defecto ahora.
+        """
+        if not mensajes:
+            return 0
+        
+        ahora = datetime.now()
+        filas = [
+            {
+                "conversation_id": m["conversation_id"],
+                "sender_type": m["sender_type"],
+                "text_content": m["text_content"],
+                "button_selected": m.get("button_selected"),
+                "previous_state": m.get("previous_state"),
+                "next_state": m.get("next_state"),
+                "timestamp": m.get("timestamp") or ahora
+            }
+            for m in mensajes
+        ]
+        
+        db.execute(insert(Message), filas)
+        if commit:
+            db.commit()
+        return len(filas)
+    
     @staticmethod
     def get_conversation_history(
         db: Session, 
@@ -128,20 +169,31 @@ class LogService:
         user_id: int,
         include_active_only: bool = False,
         limit: int = 10,
-        skip: int = 0
+        skip: int = 0,
+        before_id: Optional[int] = None
     ) -> List[Conversation]:
         """
         Obtiene las conversaciones de un usuario.
+        Con before_id pagina por cursor (id < before_id) en lugar de OFFSET.
         """
-        query = db.query(Conversation).filter(Conversation.user_id == user_id)
+        # Listado: las relaciones (messages, user) no se cargan; accederlas lanza en vez de hacer N+1
+        query = (
+            db.query(Conversation)
+            .options(raiseload("*"))
+            .filter(Conversation.user_id == user_id)
+        )
         
         if include_active_only:
             query = query.filter(Conversation.is_active == True)
+        
+        if before_id is not None:
+            query = query.filter(Conversation.id < before_id)
+        elif skip:
+            query = query.offset(skip)
             
         return (
             query
             .order_by(Conversation.id.desc())  # ✅ CORREGIDO - Usar .id en lugar de .created_at
-            .offset(skip)
             .limit(limit)
             .all()
         )
@@ -231,16 +283,14 @@ class LogService:
         metadata_json = None
         if metadata_dict:
             try:
-                from app.api.endpoints.chat import clean_data_for_json, safe_json_dumps
+                from app.api.endpoints.chat import safe_json_dumps
             except ImportError:
-                def clean_data_for_json(data):
-                    return data
                 def safe_json_dumps(data):
                     import json
-                    return json.dumps(data, ensure_ascii=False)
+                    return json.dumps(data, ensure_ascii=False, default=str)
             try:
-                metadata_limpio = clean_data_for_json(metadata_dict)
-                metadata_json = safe_json_dumps(metadata_limpio)
+                # safe_json_dumps ya resuelve Decimal/fechas: sin pasada de limpieza previa
+                metadata_json = safe_json_dumps(metadata_dict)
             except Exception as e:
                 print(f"⚠️ Error serializando metadata: {e}")
                 metadata_json = None
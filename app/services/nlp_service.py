@@ -17,10 +17,38 @@ import os
 import glob
 from pathlib import Path
 import numpy as np
+from functools import lru_cache
 from app.services.cache_service import cache_service, cache_result
 
 logger = logging.getLogger(__name__)
 
+# Mensajes más largos que esto no se cachean (acota la memoria del cache)
+_MAX_LEN_CACHE_PREDICCION = 64
+
+
+@lru_cache(maxsize=4096)
+def _predict_cached(texto_norm: str) -> dict:
+    """Predicción memoizada por texto normalizado (la predicción es pura respecto al texto)"""
+    return nlp_service.predict(texto_norm)
+
+
+def predict_cached(texto: str) -> dict:
+    """
+    Predicción con cache por proceso para frases frecuentes ("si", "no", "hola").
+    La clasificación no distingue mayúsculas, así que se normaliza antes de buscar.
+    """
+    texto_norm = texto.lower().strip() if texto else ""
+    if len(texto_norm) >= _MAX_LEN_CACHE_PREDICCION:
+        return nlp_service.predict(texto)
+    # Copia para que los llamadores no muten el valor cacheado
+    return dict(_predict_cached(texto_norm))
+
+
+def limpiar_cache_predicciones():
+    """Invalidar predicciones memoizadas (llamar al recargar/reentrenar el modelo)"""
+    _predict_cached.cache_clear()
+
+
 def obtener_modelo_mas_reciente():
     """Obtener modelo más reciente con búsqueda mejorada"""
     from pathlib import Path
@@ -260,6 +288,7 @@ class ImprovedNLPService:
     
     def _load_model(self):
         """Cargar modelo con entrenamiento mejorado si es necesario"""
+        limpiar_cache_predicciones()
         try:
             from joblib import load
             model_path = obtener_modelo_mas_reciente()
@@ -361,6 +390,7 @@ class ImprovedNLPService:
             # Entrenar clasificador mejorado
             self.model = MultinomialNB(alpha=0.5)  # Suavizado reducido para mejor precisión
             self.model.fit(X, encoded_labels)
+            limpiar_cache_predicciones()
             
             # Validación cruzada
             scores = cross_val_score(self.model, X, encoded_labels, cv=3, scoring='accuracy')
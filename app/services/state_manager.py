@@ -11,13 +11,39 @@ from app.models.conversation import Conversation
 from app.models.message import Message
 from app.models.user import User
 
+import os
+from types import MappingProxyType
+
 import yaml
 
-try:
-    with open("base_conocimiento.yaml", encoding="utf-8") as f:
-        kb = yaml.safe_load(f)
-except:
-    kb = {}
+# Loader en C (libyaml) si está disponible
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_KB_PATH = "base_conocimiento.yaml"
+_kb_cache = None  # (mtime, base de conocimiento inmutable)
+
+
+def cargar_base_conocimiento() -> MappingProxyType:
+    """
+    Base de conocimiento YAML (legado: los estados ya viven en BD).
+    Se parsea bajo demanda, no al importar, y solo se vuelve a parsear si cambia el archivo.
+    """
+    global _kb_cache
+    try:
+        mtime = os.path.getmtime(_KB_PATH)
+        if _kb_cache is None or _kb_cache[0] != mtime:
+            with open(_KB_PATH, encoding="utf-8") as f:
+                _kb_cache = (mtime, MappingProxyType(yaml.load(f, Loader=_YAML_LOADER) or {}))
+        return _kb_cache[1]
+    except Exception:
+        return MappingProxyType({})
+
+
+def __getattr__(name):
+    # Compatibilidad: `state_manager.kb` sigue disponible, pero se resuelve de forma perezosa
+    if name == "kb":
+        return cargar_base_conocimiento()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ✅ FUNCIONES DE SERIALIZACIÓN JSON MOVIDAS AQUÍ (sin importación circular)
 class CustomJSONEncoder(json.JSONEncoder):
@@ -93,22 +119,6 @@ def clean_data_for_json(obj):
         except:
             return str(obj)
 
-def limpiar_contexto_para_bd(contexto: Dict[str, Any]) -> Dict[str, Any]:
-    """Limpia el contexto convirtiendo tipos problemáticos"""
-    contexto_limpio = {}
-    
-    for key, value in contexto.items():
-        if isinstance(value, Decimal):
-            contexto_limpio[key] = int(value)
-        elif isinstance(value, (datetime, date)):
-            contexto_limpio[key] = value.isoformat()
-        elif isinstance(value, (list, dict)):
-            contexto_limpio[key] = clean_data_for_json(value)
-        else:
-            contexto_limpio[key] = value
-    
-    return contexto_limpio
-
 class StateManager:
     """
     Gestiona el estado de las conversaciones en el sistema de negociación.
@@ -177,13 +187,10 @@ class StateManager:
             # 2. ✅ Manejar contexto de forma segura con serialización mejorada
             if context:
                 try:
-                    # ✅ LIMPIAR CONTEXTO ANTES DE SERIALIZAR
-                    context_limpio = limpiar_contexto_para_bd(context)
-                    context_json = safe_json_dumps(context_limpio)
-                    
-                    # Usar métodos del objeto si existen
+                    # ✅ La columna JSONText serializa (Decimal/fechas incluidos) en una sola pasada al hacer flush;
+                    # los cambios en sitio del dict cargado los registra ContextoMutable
                     if hasattr(conversation, 'context_data'):
-                        conversation.context_data = context_json
+                        conversation.context_data = dict(context)
                     
                     print(f"💾 Contexto guardado: {len(context)} elementos")
                     
@@ -312,28 +319,17 @@ class StateManager:
         ✅ VERSIÓN MEJORADA - Obtiene context como diccionario de forma segura
         """
         try:
-            # 1. Verificar context_data (campo principal)
-            if hasattr(conversation, 'context_data') and conversation.context_data:
-                if isinstance(conversation.context_data, dict):
-                    return conversation.context_data
-                elif isinstance(conversation.context_data, str) and conversation.context_data.strip():
-                    try:
-                        parsed = json.loads(conversation.context_data)
-                        if isinstance(parsed, dict):
-                            return parsed
-                    except json.JSONDecodeError:
-                        pass
-            
-            # 2. Verificar context_data (campo backup)
-            if hasattr(conversation, 'context_data') and conversation.context_data:
-                if isinstance(conversation.context_data, str) and conversation.context_data.strip():
-                    try:
-                        if conversation.context_data.startswith('{'):
-                            parsed = json.loads(conversation.context_data)
-                            if isinstance(parsed, dict):
-                                return parsed
-                    except json.JSONDecodeError:
-                        pass
+            # La columna JSON entrega un dict; un str solo aparece si se asignó JSON sin guardar aún
+            contexto = getattr(conversation, 'context_data', None)
+            if isinstance(contexto, dict):
+                return contexto
+            if isinstance(contexto, str) and contexto.strip().startswith('{'):
+                try:
+                    parsed = json.loads(contexto)
+                    if isinstance(parsed, dict):
+                        return parsed
+                except json.JSONDecodeError:
+                    pass
             
             return {}
             
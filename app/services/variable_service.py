@@ -1,13 +1,58 @@
 import re
 import json
-from typing import Dict, Any, Optional
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 
 logger = logging.getLogger(__name__)
 
+# ✅ PATRONES PRECOMPILADOS (una sola pasada de re.sub sobre el texto)
+_VARIABLE_RE = re.compile(r'\{\{([^}]+)\}\}')
+_LINEA_SOLO_SIGNOS_RE = re.compile(r'^[\$\s\:]+$')
+
+# ✅ ALIAS DE VARIABLES (nombre pedido → claves alternativas en el contexto)
+_ALIAS_VARIABLES = {
+    "oferta_2": ("Oferta_2", "OFERTA_2"),
+    "Oferta_2": ("oferta_2", "OFERTA_2"),
+    "nombre_cliente": ("Nombre_del_cliente",),
+    "Nombre_del_cliente": ("nombre_cliente",),
+    "saldo_total": ("Saldo_total",)
+}
+
+# Fragmentos de nombre que identifican variables monetarias
+_PALABRAS_MONEDA = ('saldo', 'oferta', 'capital', 'interes', 'cuota', 'pago', 'monto')
+
+# ✅ TEXTO SIN DATOS DEL CLIENTE POR (template, día): solo depende del texto y de la fecha
+_SIN_DATOS_CACHE_MAX = 256
+_sin_datos_cache: Dict[Tuple[str, date], str] = {}
+
+
+@lru_cache(maxsize=256)
+def _compilar_template(texto: str) -> Tuple[str, ...]:
+    """
+    Template partido una sola vez en literales y nombres de variable alternados:
+    (literal, variable, literal, ..., literal). Los templates son pocos y estables.
+    """
+    partes = _VARIABLE_RE.split(texto)
+    partes[1::2] = [nombre.strip() for nombre in partes[1::2]]
+    return tuple(partes)
+
+
+# ✅ CONSULTA DE CLIENTE CONSTRUIDA UNA SOLA VEZ (misma sentencia → misma entrada en la caché de compilación)
+_CLIENTE_DIRECTO_QUERY = text("""
+    SELECT TOP 1 
+        Nombre_del_cliente, Saldo_total, banco,
+        Oferta_1, Oferta_2, 
+        Hasta_3_cuotas, Hasta_6_cuotas, Hasta_12_cuotas,
+        Producto, Telefono, Email
+    FROM ConsolidadoCampañasNatalia 
+    WHERE CAST(Cedula AS VARCHAR) = :cedula
+    ORDER BY Saldo_total DESC
+""")
+
 class VariableService:
     """✅ SERVICIO DE VARIABLES 100% DINÁMICO - SIN VALORES HARDCODEADOS"""
     
@@ -36,20 +81,23 @@ class VariableService:
                 logger.info(f"⚠️ [RESOLVER] Sin datos reales del cliente - usando texto base")
                 return self._resolver_sin_datos_cliente(texto)
             
+            # ✅ TEXTO SIN VARIABLES: nada que resolver
+            if '{{' not in texto:
+                return texto
+            
             logger.info(f"✅ [RESOLVER] Datos reales disponibles:")
             logger.info(f"   Cliente: {contexto.get('Nombre_del_cliente')}")
             logger.info(f"   Saldo: ${contexto.get('saldo_total', 0):,}")
             
-            # ✅ RESOLVER CON DATOS REALES
-            patron = r'\{\{([^}]+)\}\}'
-            
-            def reemplazar_variable(match):
-                nombre_variable = match.group(1).strip()
+            # ✅ RESOLVER CON DATOS REALES (template precompilado: solo se resuelven las variables)
+            piezas = list(_compilar_template(texto))
+            for i in range(1, len(piezas), 2):
+                nombre_variable = piezas[i]
                 valor = self._resolver_variable_real(nombre_variable, contexto)
                 logger.info(f"   🎯 [RESOLVER] {{{{{nombre_variable}}}}} → {valor}")
-                return valor
+                piezas[i] = valor
             
-            texto_resuelto = re.sub(patron, reemplazar_variable, texto)
+            texto_resuelto = ''.join(piezas)
             logger.info(f"✅ [RESOLVER] Variables resueltas con datos reales")
             return texto_resuelto
             
@@ -58,11 +106,14 @@ class VariableService:
             return texto
     
     def _resolver_sin_datos_cliente(self, texto: str) -> str:
-        """✅ RESOLVER CUANDO NO HAY DATOS REALES"""
+        """✅ RESOLVER CUANDO NO HAY DATOS REALES (memoizado por template y día)"""
+        clave = (texto, date.today())
+        cacheado = _sin_datos_cache.get(clave)
+        if cacheado is not None:
+            return cacheado
+        
         try:
             # ✅ ELIMINAR VARIABLES NO RESUELTAS EN LUGAR DE USAR VALORES HARDCODEADOS
-            patron = r'\{\{([^}]+)\}\}'
-            
             def reemplazar_variable_vacia(match):
                 nombre_variable = match.group(1).strip()
                 
@@ -75,7 +126,7 @@ class VariableService:
                     # ✅ ELIMINAR VARIABLES SIN DATOS EN LUGAR DE HARDCODEAR
                     return ""
             
-            texto_limpio = re.sub(patron, reemplazar_variable_vacia, texto)
+            texto_limpio = _VARIABLE_RE.sub(reemplazar_variable_vacia, texto) if '{{' in texto else texto
             
             # ✅ LIMPIAR LÍNEAS VACÍAS RESULTANTES
             lineas = texto_limpio.split('\n')
@@ -84,15 +135,18 @@ class VariableService:
             for linea in lineas:
                 linea_limpia = linea.strip()
                 # ✅ ELIMINAR LÍNEAS QUE SOLO TIENEN SIGNOS $ O ESTÁN VACÍAS
-                if linea_limpia and not re.match(r'^[\$\s\:]+$', linea_limpia):
+                if linea_limpia and not _LINEA_SOLO_SIGNOS_RE.match(linea_limpia):
                     lineas_limpias.append(linea_limpia)
             
             resultado = '\n'.join(lineas_limpias)
             
             # ✅ SI EL RESULTADO ESTÁ VACÍO, DAR MENSAJE GENÉRICO
             if not resultado.strip():
-                return "Para continuar, necesito tu número de cédula."
+                resultado = "Para continuar, necesito tu número de cédula."
             
+            if len(_sin_datos_cache) >= _SIN_DATOS_CACHE_MAX:
+                _sin_datos_cache.clear()
+            _sin_datos_cache[clave] = resultado
             return resultado
             
         except Exception as e:
@@ -109,16 +163,8 @@ class VariableService:
                 return self._formatear_valor_dinamico(valor, nombre)
         
         # ✅ 2. MAPEO DE ALIAS
-        alias_mapping = {
-            "oferta_2": ["Oferta_2", "OFERTA_2"],
-            "Oferta_2": ["oferta_2", "OFERTA_2"],
-            "nombre_cliente": ["Nombre_del_cliente"],
-            "Nombre_del_cliente": ["nombre_cliente"],
-            "saldo_total": ["Saldo_total"]
-        }
-        
-        if nombre in alias_mapping:
-            for alias in alias_mapping[nombre]:
+        if nombre in _ALIAS_VARIABLES:
+            for alias in _ALIAS_VARIABLES[nombre]:
                 if alias in contexto and contexto[alias] is not None and contexto[alias] != 0:
                     valor = contexto[alias]
                     return self._formatear_valor_dinamico(valor, nombre)
@@ -144,8 +190,8 @@ class VariableService:
                 return ""
             
             # ✅ VARIABLES MONETARIAS
-            if any(keyword in tipo_variable.lower() for keyword in 
-                ['saldo', 'oferta', 'capital', 'interes', 'cuota', 'pago', 'monto']):
+            tipo_lower = tipo_variable.lower()
+            if any(keyword in tipo_lower for keyword in _PALABRAS_MONEDA):
                 return self._formatear_moneda_dinamica(valor)
             
             # ✅ VARIABLES DE TEXTO
@@ -249,18 +295,7 @@ class VariableService:
             if not cedula:
                 return {}
                 
-            query = text("""
-                SELECT TOP 1 
-                    Nombre_del_cliente, Saldo_total, banco,
-                    Oferta_1, Oferta_2, 
-                    Hasta_3_cuotas, Hasta_6_cuotas, Hasta_12_cuotas,
-                    Producto, Telefono, Email
-                FROM ConsolidadoCampañasNatalia 
-                WHERE CAST(Cedula AS VARCHAR) = :cedula
-                ORDER BY Saldo_total DESC
-            """)
-            
-            result = self.db.execute(query, {"cedula": str(cedula)}).fetchone()
+            result = self.db.execute(_CLIENTE_DIRECTO_QUERY, {"cedula": str(cedula)}).fetchone()
             
             if result:
                 return {
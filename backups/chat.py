@@ -5,25 +5,247 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from decimal import Decimal
 from datetime import datetime, timedelta, date
+from functools import lru_cache
 from app.api.deps import get_db
 from app.schemas.chat import ChatRequest, ChatResponse, ConversationHistoryResponse, CedulaTestResponse, CedulaTestRequest
-from app.services.conversation_service import crear_conversation_service
+from app.services.conversation_service import crear_conversation_service, obtener_template_estado
 from app.services.state_manager import StateManager
 from app.services.log_service import LogService
+from app.services.cache_service import cache_service
 from app.models.message import Message
 from app.models.conversation import Conversation
 from app.models.user import User
 from dotenv import load_dotenv
+import copy
+import hashlib
 import json
 import logging
 import os
 import re
+import time
 import traceback
 
 load_dotenv()
 router = APIRouter(prefix="/chat", tags=["Chat"])
 logger = logging.getLogger("uvicorn.error")
 
+# Tabla de normalización: se quitan tildes una sola vez por mensaje
+_ACCENT_MAP = str.maketrans("áéíóúÁÉÍÓÚ", "aeiouAEIOU")
+
+# Botones estáticos: se construyen una sola vez y cada respuesta recibe una copia de la lista
+_BTN_REINTENTAR_CEDULA = (
+    {"id": "reintentar", "text": "Intentar otra cédula"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+_BTN_RECHAZO = (
+    {"id": "plan_flexible", "text": "Plan más flexible"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+_BTN_FALLBACK_CON_CLIENTE = (
+    {"id": "opciones_pago", "text": "Ver opciones de pago"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+_BTN_SOLICITAR_CEDULA = (
+    {"id": "proporcionar_cedula", "text": "Proporcionar cédula"},
+    {"id": "ayuda", "text": "Necesito ayuda"},
+)
+_BTN_CLIENTE_ENCONTRADO = (
+    {"id": "ver_opciones", "text": "Sí, quiero ver opciones"},
+    {"id": "mas_info", "text": "Más información"},
+    {"id": "no_ahora", "text": "No por ahora"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+_BTN_INFORMAR_DEUDA = (
+    {"id": "si_opciones", "text": "Sí, quiero ver opciones"},
+    {"id": "mas_info", "text": "Más información"},
+    {"id": "no_ahora", "text": "No por ahora"},
+)
+_BTN_PROPONER_PLANES = (
+    {"id": "pago_unico", "text": "Pago único con descuento"},
+    {"id": "plan_3_cuotas", "text": "Plan 3 cuotas"},
+    {"id": "plan_6_cuotas", "text": "Plan 6 cuotas"},
+    {"id": "plan_12_cuotas", "text": "Plan 12 cuotas"},
+)
+_BTN_GENERAR_ACUERDO = (
+    {"id": "confirmar_acuerdo", "text": "Confirmar acuerdo"},
+    {"id": "modificar_terminos", "text": "Modificar términos"},
+)
+_BTN_FINALIZAR = (
+    {"id": "nueva_consulta", "text": "Nueva consulta"},
+    {"id": "finalizar", "text": "Finalizar"},
+)
+_BTN_AYUDA_ASESOR = (
+    {"id": "ayuda", "text": "Necesito ayuda"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+_BTN_AYUDA = (
+    {"id": "ayuda", "text": "Necesito ayuda"},
+)
+_BTN_OPENAI_PLANES = (
+    {"id": "pago_unico", "text": "Pago único"},
+    {"id": "plan_cuotas", "text": "Plan de cuotas"},
+    {"id": "mas_descuento", "text": "¿Más descuento?"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+_BTN_OPENAI_ACUERDO = (
+    {"id": "confirmar_acuerdo", "text": "Confirmar acuerdo"},
+    {"id": "modificar", "text": "Modificar términos"},
+)
+_BTN_OPENAI_CON_CLIENTE = (
+    {"id": "opciones_pago", "text": "Ver opciones"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+_BTN_CONTEXTUAL_DEUDA = (
+    {"id": "ver_opciones", "text": "Ver opciones de pago"},
+    {"id": "mas_info", "text": "Más información"},
+)
+_BTN_CONTEXTUAL_PLANES = (
+    {"id": "pago_unico", "text": "Pago único"},
+    {"id": "cuotas", "text": "Plan cuotas"},
+    {"id": "asesor", "text": "Hablar con asesor"},
+)
+
+# Estados en los que se muestran opciones de pago (deuda informada o planes propuestos)
+_ESTADOS_PLAN = frozenset({'proponer_planes_pago', 'informar_deuda'})
+
+# (variante, estado, tiene_cliente) → botones; una sola búsqueda sustituye las ramas de los dispatchers
+_BUTTON_TABLE = {
+    ('dinamico', 'informar_deuda', True): _BTN_INFORMAR_DEUDA,
+    ('dinamico', 'proponer_planes_pago', True): _BTN_PROPONER_PLANES,
+    **{('dinamico', 'generar_acuerdo', c): _BTN_GENERAR_ACUERDO for c in (True, False)},
+    **{('dinamico', 'finalizar_conversacion', c): _BTN_FINALIZAR for c in (True, False)},
+    **{('openai', estado, True): _BTN_OPENAI_PLANES for estado in _ESTADOS_PLAN},
+    ('openai', 'generar_acuerdo', True): _BTN_OPENAI_ACUERDO,
+    ('contextual', 'informar_deuda', True): _BTN_CONTEXTUAL_DEUDA,
+    ('contextual', 'proponer_planes_pago', True): _BTN_CONTEXTUAL_PLANES,
+}
+
+# (variante, tiene_cliente) → botones cuando el estado no tiene entrada propia
+_BOTONES_POR_DEFECTO = {
+    ('dinamico', True): _BTN_AYUDA_ASESOR,
+    ('dinamico', False): _BTN_AYUDA_ASESOR,
+    ('openai', True): _BTN_OPENAI_CON_CLIENTE,
+    ('openai', False): _BTN_SOLICITAR_CEDULA,
+    ('contextual', True): _BTN_AYUDA_ASESOR,
+    ('contextual', False): _BTN_AYUDA_ASESOR,
+}
+
+# Palabras de confirmación / rechazo de las reglas básicas
+_PALABRAS_CONFIRMACION = ('si', 'acepto', 'ok', 'esta bien', 'de acuerdo')
+_PALABRAS_RECHAZO = ('no', 'nop', 'negativo', 'imposible', 'no puedo')
+
+# Consulta de cliente: ofertas, cuotas y porcentajes se resuelven en SQL (sin ramas en Python)
+_CLIENTE_COMPLETO_QUERY = text("""
+    SELECT TOP 1 
+        c.[Nombre_del_cliente] AS nombre,
+        s.saldo_total,
+        c.[banco] AS banco,
+        o.oferta_1,
+        o.oferta_2,
+        o.hasta_3_cuotas,
+        o.hasta_6_cuotas,
+        o.hasta_12_cuotas,
+        c.[Producto] AS producto,
+        c.[Telefono] AS telefono,
+        c.[Email] AS email,
+        CAST(ISNULL(c.[Capital], 0) AS BIGINT) AS capital,
+        CAST(ISNULL(c.[Intereses], 0) AS BIGINT) AS intereses,
+        s.saldo_total - o.oferta_1 AS ahorro_oferta_1,
+        s.saldo_total - o.oferta_2 AS ahorro_oferta_2,
+        CAST((s.saldo_total - o.oferta_1) * 100.0 / NULLIF(s.saldo_total, 0) AS INT) AS porcentaje_desc_1,
+        CAST((s.saldo_total - o.oferta_2) * 100.0 / NULLIF(s.saldo_total, 0) AS INT) AS porcentaje_desc_2,
+        CAST(s.saldo_total * 0.1 AS BIGINT) AS pago_minimo
+    FROM ConsolidadoCampañasNatalia c
+    CROSS APPLY (
+        SELECT CAST(ISNULL(c.[Saldo_total], 0) AS BIGINT) AS saldo_total
+    ) s
+    CROSS APPLY (
+        SELECT
+            CAST(CASE WHEN c.[Oferta_1] > 0 THEN c.[Oferta_1] ELSE s.saldo_total * 0.6 END AS BIGINT) AS oferta_1,
+            CAST(CASE WHEN c.[Oferta_2] > 0 THEN c.[Oferta_2] ELSE s.saldo_total * 0.7 END AS BIGINT) AS oferta_2,
+            CAST(CASE WHEN c.[Hasta_3_cuotas] > 0 THEN c.[Hasta_3_cuotas] ELSE s.saldo_total * 0.85 / 3 END AS BIGINT) AS hasta_3_cuotas,
+            CAST(CASE WHEN c.[Hasta_6_cuotas] > 0 THEN c.[Hasta_6_cuotas] ELSE s.saldo_total * 0.9 / 6 END AS BIGINT) AS hasta_6_cuotas,
+            CAST(CASE WHEN c.[Hasta_12_cuotas] > 0 THEN c.[Hasta_12_cuotas] ELSE s.saldo_total / 12.0 END AS BIGINT) AS hasta_12_cuotas
+    ) o
+    WHERE CAST(c.Cedula AS VARCHAR) = :cedula
+    ORDER BY c.Saldo_total DESC
+""")
+
+_CLIENTE_CACHE_TTL = 60  # segundos
+
+# Tablas críticas del health check: los nombres se interpolan en SQL, solo se aceptan identificadores simples
+_IDENTIFICADOR_TABLA_RE = re.compile(r'^[A-Za-zÀ-ÿ_]\w*$')
+_TABLAS_CRITICAS = (
+    "Estados_Conversacion",
+    "ml_intention_mappings",
+    "keyword_condition_patterns",
+    "ConsolidadoCampañasNatalia",
+)
+for _tabla in _TABLAS_CRITICAS:
+    if not _IDENTIFICADOR_TABLA_RE.match(_tabla):
+        raise ValueError(f"Nombre de tabla no permitido en health check: {_tabla!r}")
+_CONTEO_TABLAS_CRITICAS = tuple((tabla, f"SELECT COUNT(*) FROM [{tabla}]") for tabla in _TABLAS_CRITICAS)
+
+_CONTEXTO_QUERY = text("SELECT context_data FROM conversations WHERE id = :conv_id")
+
+# Mensaje al identificar al cliente (plantilla fija, solo cambian nombre/banco/saldo)
+_MSG_CLIENTE_TPL = """¡Perfecto, {nombre}! 
+
+📋 **Información de tu cuenta:**
+🏦 Entidad: {banco}
+💰 Saldo actual: ${saldo:,}
+
+¿Te gustaría conocer las opciones de pago disponibles para ti?"""
+
+
+@lru_cache(maxsize=1024)
+def _mensaje_cliente_encontrado(nombre: str, banco: str, saldo: int) -> str:
+    """Mensaje formateado, memoizado por cliente (se repite en cada reinicio de conversación)"""
+    return _MSG_CLIENTE_TPL.format(nombre=nombre, banco=banco, saldo=saldo)
+
+
+# Tokenización de palabras (sin puntuación) para intersección con conjuntos de palabras clave
+_TOKEN_RE = re.compile(r'\w+')
+
+# Patrones de cédula compilados una vez, en orden de prioridad
+_PATRONES_CEDULA = tuple(re.compile(patron, re.IGNORECASE) for patron in (
+    r'\b(\d{7,12})\b',
+    r'cédula\s*:?\s*(\d{7,12})',
+    r'cedula\s*:?\s*(\d{7,12})',
+    r'documento\s*:?\s*(\d{7,12})',
+    r'cc\s*:?\s*(\d{7,12})',
+    r'es\s+(\d{7,12})',
+    r'tengo\s+(\d{7,12})',
+    r'mi\s+(\d{7,12})',
+))
+
+# Separadores no numéricos (normalización de la cédula recibida en /test-cedula)
+_NO_DIGITOS_RE = re.compile(r'\D+')
+
+# Palabras clave de la respuesta OpenAI → (estado con cliente, estado sin cliente), en orden de prioridad
+_ESTADO_POR_PALABRAS_OPENAI = (
+    (frozenset({'opciones', 'planes', 'pago', 'pagos', 'cuotas'}), ('proponer_planes_pago', 'validar_documento')),
+    (frozenset({'acuerdo', 'acuerdos', 'confirmar', 'proceder'}), ('generar_acuerdo', 'generar_acuerdo')),
+    (frozenset({'supervisor', 'asesor', 'asesores', 'especialista'}), ('escalamiento', 'escalamiento')),
+    (frozenset({'información', 'informacion', 'detalle', 'detalles', 'saldo'}), ('informar_deuda', 'validar_documento')),
+)
+
+# Índice palabra → (prioridad, destinos) para resolver todo en una sola pasada
+_PALABRA_A_DESTINO = {
+    palabra: (prioridad, destinos)
+    for prioridad, (palabras, destinos) in enumerate(_ESTADO_POR_PALABRAS_OPENAI)
+    for palabra in palabras
+}
+
+# Transición por defecto según el estado actual → (estado con cliente, estado sin cliente)
+_TRANSICION_POR_ESTADO = {
+    'inicial': ('validar_documento', 'validar_documento'),
+    'validar_documento': ('informar_deuda', 'validar_documento'),
+    'informar_deuda': ('proponer_planes_pago', 'proponer_planes_pago'),
+    'proponer_planes_pago': ('generar_acuerdo', 'generar_acuerdo'),
+    'generar_acuerdo': ('finalizar_conversacion', 'finalizar_conversacion'),
+}
+
 
 class CustomJSONEncoder(json.JSONEncoder):
     """Encoder personalizado para manejar tipos especiales"""
@@ -116,33 +338,20 @@ def limpiar_contexto_para_bd(contexto: Dict[str, Any]) -> Dict[str, Any]:
     return contexto_limpio
 
 
-class OptimizedChatProcessor:
+class _ServiciosProcesador:
     """
-    🎯 PROCESADOR DE CHAT OPTIMIZADO Y DINÁMICO
-    - Sistema 100% dinámico basado en BD
-    - OpenAI como motor principal (80% de casos)
-    - ML como fallback
-    - Reglas dinámicas desde BD
-    - Sin valores hardcodeados
+    Servicios compartidos por todos los OptimizedChatProcessor del proceso.
+    OpenAI, ML y la configuración dinámica cargada desde BD no dependen de la
+    sesión; los servicios que consultan BD se enlazan por request.
     """
     
-    def __init__(self, db: Session):
-        self.db = db
-        self.dynamic_transition_service = self._init_dynamic_service()
+    def __init__(self):
         self.openai_service = self._init_openai_service()
         self.ml_service = self._init_ml_service()
-        self.variable_service = self._init_variable_service()
+        self.ml_predict = self._init_ml_predict()
+        self._transiciones = None
         
-        logger.info("✅ OptimizedChatProcessor inicializado - Sistema 100% dinámico")
-    
-    def _init_dynamic_service(self):
-        """Inicializar servicio de transiciones dinámicas"""
-        try:
-            from app.services.dynamic_transition_service import create_dynamic_transition_service
-            return create_dynamic_transition_service(self.db)
-        except Exception as e:
-            logger.error(f"❌ Error inicializando servicio dinámico: {e}")
-            return None
+        logger.info("✅ Servicios del procesador inicializados (compartidos por proceso)")
     
     def _init_openai_service(self):
         """Inicializar OpenAI como motor principal"""
@@ -164,14 +373,91 @@ class OptimizedChatProcessor:
             logger.warning(f"⚠️ ML no disponible: {e}")
             return None
     
-    def _init_variable_service(self):
-        """Inicializar servicio de variables"""
+    def _init_ml_predict(self):
+        """Predicción ML con cache por proceso (fallback: predict directo)"""
+        try:
+            from app.services.nlp_service import predict_cached
+            return predict_cached
+        except Exception:
+            return self.ml_service.predict if self.ml_service else None
+    
+    def transiciones_para(self, db: Session):
+        """
+        Servicio de transiciones enlazado a la sesión del request.
+        La configuración se carga una vez (y al vencer su TTL) en la instancia
+        compartida; cada request recibe una copia superficial con su propia sesión.
+        """
+        try:
+            if self._transiciones is None:
+                from app.services.dynamic_transition_service import create_dynamic_transition_service
+                self._transiciones = create_dynamic_transition_service(db)
+            elif time.time() - self._transiciones.cache_timestamp > self._transiciones.cache_ttl:
+                self._transiciones.db = db
+                self._transiciones._load_configuration()
+            
+            servicio = copy.copy(self._transiciones)
+            servicio.db = db
+            return servicio
+        except Exception as e:
+            logger.error(f"❌ Error inicializando servicio dinámico: {e}")
+            return None
+    
+    def variables_para(self, db: Session):
+        """Servicio de variables enlazado a la sesión del request"""
         try:
             from app.services.variable_service import crear_variable_service
-            return crear_variable_service(self.db)
+            return crear_variable_service(db)
         except Exception as e:
             logger.warning(f"⚠️ Variable service no disponible: {e}")
             return None
+
+
+# Estadísticas de OpenAI memoizadas 1s: ráfagas de monitores comparten la misma lectura
+_OPENAI_STATS_TTL = 1.0
+_openai_stats_cache: Dict[str, Any] = {}
+_openai_stats_timestamp = 0.0
+
+
+def _openai_stats_cached(openai_service) -> Dict[str, Any]:
+    global _openai_stats_cache, _openai_stats_timestamp
+    ahora = time.monotonic()
+    if ahora - _openai_stats_timestamp > _OPENAI_STATS_TTL:
+        _openai_stats_cache = openai_service.get_stats()
+        _openai_stats_timestamp = ahora
+    return _openai_stats_cache
+
+
+@lru_cache(maxsize=1)
+def _obtener_servicios_procesador() -> _ServiciosProcesador:
+    """Instancia única de los servicios compartidos (creación perezosa)"""
+    return _ServiciosProcesador()
+
+
+def get_processor(db: Session = Depends(get_db)) -> "OptimizedChatProcessor":
+    """Dependencia FastAPI: procesador ligero enlazado a la sesión del request"""
+    return OptimizedChatProcessor(db)
+
+
+class OptimizedChatProcessor:
+    """
+    🎯 PROCESADOR DE CHAT OPTIMIZADO Y DINÁMICO
+    - Sistema 100% dinámico basado en BD
+    - OpenAI como motor principal (80% de casos)
+    - ML como fallback
+    - Reglas dinámicas desde BD
+    - Sin valores hardcodeados
+    """
+    
+    def __init__(self, db: Session, servicios: Optional["_ServiciosProcesador"] = None):
+        # Los servicios independientes de la sesión se construyen una vez por proceso;
+        # aquí solo se enlazan a la sesión del request
+        servicios = servicios or _obtener_servicios_procesador()
+        self.db = db
+        self.dynamic_transition_service = servicios.transiciones_para(db)
+        self.openai_service = servicios.openai_service
+        self.ml_service = servicios.ml_service
+        self._ml_predict = servicios.ml_predict
+        self.variable_service = servicios.variables_para(db)
     
     def process_message_optimized(self, mensaje: str, contexto: Dict[str, Any], estado_actual: str) -> Dict[str, Any]:
         """
@@ -182,7 +468,11 @@ class OptimizedChatProcessor:
         4. Reglas básicas (último recurso)
         """
         
-        logger.info(f"🚀 [OPTIMIZED] Procesando: '{mensaje[:30]}...' en estado '{estado_actual}'")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🚀 [OPTIMIZED] Procesando: '%s...' en estado '%s'", mensaje[:30], estado_actual)
+        
+        # Normalización única del mensaje (minúsculas y sin tildes) para todos los helpers
+        msg_norm = mensaje.translate(_ACCENT_MAP).lower().strip()
         
         # ✅ 1. DETECCIÓN AUTOMÁTICA DE CÉDULAS (PRIORIDAD MÁXIMA)
         cedula_detectada = self._detectar_cedula_inteligente(mensaje)
@@ -195,32 +485,20 @@ class OptimizedChatProcessor:
             if resultado_openai.get('success'):
                 return resultado_openai
             else:
-                logger.info(f"🔄 OpenAI falló, usando fallback")
+                logger.debug("🔄 OpenAI falló, usando fallback")
         
         # ✅ 3. FALLBACK: SISTEMA DINÁMICO + ML
         if self.dynamic_transition_service:
-            return self._procesar_con_sistema_dinamico(mensaje, contexto, estado_actual)
+            return self._procesar_con_sistema_dinamico(mensaje, contexto, estado_actual, msg_norm)
         
         # ✅ 4. ÚLTIMO RECURSO: REGLAS BÁSICAS
-        return self._procesar_con_reglas_basicas(mensaje, contexto, estado_actual)
+        return self._procesar_con_reglas_basicas(mensaje, contexto, estado_actual, msg_norm)
     
     def _detectar_cedula_inteligente(self, mensaje: str) -> Optional[str]:
         """Detección robusta de cédulas con múltiples patrones"""
-        patrones_cedula = [
-            r'\b(\d{7,12})\b',                   
-            r'cédula\s*:?\s*(\d{7,12})',         
-            r'cedula\s*:?\s*(\d{7,12})',         
-            r'documento\s*:?\s*(\d{7,12})',      
-            r'cc\s*:?\s*(\d{7,12})',             
-            r'es\s+(\d{7,12})',                  
-            r'tengo\s+(\d{7,12})',               
-            r'mi\s+(\d{7,12})',                 
-        ]
-        
-        for patron in patrones_cedula:
-            matches = re.findall(patron, mensaje, re.IGNORECASE)
-            for match in matches:
-                cedula = str(match).strip()
+        for patron in _PATRONES_CEDULA:
+            for match in patron.findall(mensaje):
+                cedula = match.strip()
                 if self._validar_cedula(cedula):
                     logger.info(f"🎯 [CEDULA] Detectada: {cedula}")
                     return cedula
@@ -241,7 +519,7 @@ class OptimizedChatProcessor:
     
     def _procesar_cedula_completa(self, cedula: str, contexto: Dict[str, Any]) -> Dict[str, Any]:
         """Procesamiento completo de cédula detectada"""
-        logger.info(f"🔍 [CEDULA] Consultando cliente: {cedula}")
+        logger.debug("🔍 [CEDULA] Consultando cliente: %s", cedula)
         
         # Consultar cliente en BD
         cliente_data = self._consultar_cliente_completo(cedula)
@@ -271,97 +549,51 @@ class OptimizedChatProcessor:
                 'next_state': 'cliente_no_encontrado',
                 'contexto_actualizado': {**contexto, 'cedula_no_encontrada': cedula},
                 'mensaje_respuesta': f"No encontré información para la cédula {cedula}. Por favor verifica el número o comunícate con atención al cliente.",
-                'botones': [
-                    {"id": "reintentar", "text": "Intentar otra cédula"},
-                    {"id": "asesor", "text": "Hablar con asesor"}
-                ],
+                'botones': list(_BTN_REINTENTAR_CEDULA),
                 'metodo': 'cedula_no_encontrada',
                 'usar_resultado': True,
                 'success': True
             }
     
     def _consultar_cliente_completo(self, cedula: str) -> Dict[str, Any]:
-        """Consulta completa de cliente con cálculos dinámicos"""
+        """Consulta completa de cliente con cálculos dinámicos (cache de 60s por cédula)"""
         try:
-            query = text("""
-                SELECT TOP 1 
-                    [Nombre_del_cliente],
-                    [Saldo_total],
-                    [banco],
-                    [Oferta_1],
-                    [Oferta_2],
-                    [Hasta_3_cuotas],
-                    [Hasta_6_cuotas],
-                    [Hasta_12_cuotas],
-                    [Producto],
-                    [Telefono],
-                    [Email],
-                    [Capital],
-                    [Intereses]
-                FROM ConsolidadoCampañasNatalia 
-                WHERE CAST(Cedula AS VARCHAR) = :cedula
-                ORDER BY Saldo_total DESC
-            """)
+            # ✅ CACHE: consultas repetidas de la misma cédula no vuelven a BD
+            # (se invalida con cache_service.invalidate_client_cache / endpoint de admin)
+            datos_cache = cache_service.get_cached_client_data(str(cedula))
+            if datos_cache:
+                datos_base = {k: v for k, v in datos_cache.items() if not k.startswith('_cache')}
+                logger.debug("🎯 [CLIENTE] Desde cache: %s", cedula)
+                return {'encontrado': True, 'datos': datos_base}
             
-            result = self.db.execute(query, {"cedula": str(cedula)}).fetchone()
+            result = self.db.execute(_CLIENTE_COMPLETO_QUERY, {"cedula": str(cedula)}).mappings().fetchone()
             
             if result:
-                datos_base = {
+                datos_base = dict(result)
+                datos_base.update({
                     'cliente_encontrado': True,
                     'cedula_detectada': cedula,
-                    'Nombre_del_cliente': result[0] or "Cliente",
-                    'saldo_total': int(float(result[1])) if result[1] else 0,
-                    'banco': result[2] or "Entidad Financiera",
-                    'producto': result[8] or "Producto",
-                    'telefono': result[9] or "",
-                    'email': result[10] or "",
-                    'capital': int(float(result[11])) if result[11] else 0,
-                    'intereses': int(float(result[12])) if result[12] else 0
-                }
-                
-                # Cálculos dinámicos de ofertas
-                if result[3] and float(result[3]) > 0:
-                    datos_base['oferta_1'] = int(float(result[3]))
-                else:
-                    datos_base['oferta_1'] = int(datos_base['saldo_total'] * 0.6)  
-                
-                if result[4] and float(result[4]) > 0:
-                    datos_base['oferta_2'] = int(float(result[4]))
-                else:
-                    datos_base['oferta_2'] = int(datos_base['saldo_total'] * 0.7) 
-                
-                if result[5] and float(result[5]) > 0:
-                    datos_base['hasta_3_cuotas'] = int(float(result[5]))
-                else:
-                    datos_base['hasta_3_cuotas'] = int((datos_base['saldo_total'] * 0.85) / 3)
-                
-                if result[6] and float(result[6]) > 0:
-                    datos_base['hasta_6_cuotas'] = int(float(result[6]))
-                else:
-                    datos_base['hasta_6_cuotas'] = int((datos_base['saldo_total'] * 0.9) / 6)
-                
-                if result[7] and float(result[7]) > 0:
-                    datos_base['hasta_12_cuotas'] = int(float(result[7]))
-                else:
-                    datos_base['hasta_12_cuotas'] = int(datos_base['saldo_total'] / 12)
-                
-                # Cálculos adicionales
-                datos_base.update({
-                    'ahorro_oferta_1': datos_base['saldo_total'] - datos_base['oferta_1'],
-                    'ahorro_oferta_2': datos_base['saldo_total'] - datos_base['oferta_2'],
-                    'porcentaje_desc_1': int(((datos_base['saldo_total'] - datos_base['oferta_1']) / datos_base['saldo_total']) * 100),
-                    'porcentaje_desc_2': int(((datos_base['saldo_total'] - datos_base['oferta_2']) / datos_base['saldo_total']) * 100),
-                    'pago_minimo': int(datos_base['saldo_total'] * 0.1),
+                    'Nombre_del_cliente': datos_base.pop('nombre') or "Cliente",
+                    'banco': result['banco'] or "Entidad Financiera",
+                    'producto': result['producto'] or "Producto",
+                    'telefono': result['telefono'] or "",
+                    'email': result['email'] or "",
+                    'porcentaje_desc_1': result['porcentaje_desc_1'] or 0,
+                    'porcentaje_desc_2': result['porcentaje_desc_2'] or 0,
                     'consulta_timestamp': datetime.now().isoformat()
                 })
                 
-                logger.info(f"✅ [CLIENTE] Encontrado: {datos_base['Nombre_del_cliente']}")
-                logger.info(f"💰 Saldo: ${datos_base['saldo_total']:,}")
-                logger.info(f"🎯 Oferta mejor: ${datos_base['oferta_2']:,} ({datos_base['porcentaje_desc_2']}% desc)")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("✅ [CLIENTE] Encontrado: %s", datos_base['Nombre_del_cliente'])
+                    logger.debug("💰 Saldo: $%s", f"{datos_base['saldo_total']:,}")
+                    logger.debug("🎯 Oferta mejor: $%s (%s%% desc)",
+                                 f"{datos_base['oferta_2']:,}", datos_base['porcentaje_desc_2'])
                 
+                # Se guarda una copia: cache_client_data añade sus metadatos al dict recibido
+                cache_service.cache_client_data(str(cedula), dict(datos_base), ttl=_CLIENTE_CACHE_TTL)
                 return {'encontrado': True, 'datos': datos_base}
             
-            logger.info(f"❌ [CLIENTE] No encontrado para cédula: {cedula}")
+            logger.debug("❌ [CLIENTE] No encontrado para cédula: %s", cedula)
             return {'encontrado': False, 'datos': {}}
             
         except Exception as e:
@@ -371,6 +603,15 @@ class OptimizedChatProcessor:
     def _procesar_con_openai_principal(self, mensaje: str, contexto: Dict[str, Any], estado: str) -> Dict[str, Any]:
         """Procesamiento principal con OpenAI optimizado para cobranza"""
         try:
+            # ✅ CACHE SEMÁNTICO: (mensaje normalizado) + (estado, cliente) → respuesta previa, sin llamar al LLM
+            # Hash del mensaje completo normalizado: un prefijo haría colisionar mensajes distintos
+            mensaje_cache = hashlib.sha1(" ".join(mensaje.lower().split()).encode()).hexdigest()
+            contexto_hash = self._hash_contexto_openai(estado, contexto)
+            resultado_cache = cache_service.get_cached_openai_response(mensaje_cache, contexto_hash)
+            if resultado_cache:
+                logger.info(f"🎯 [OPENAI] Respuesta desde cache")
+                return {**resultado_cache, 'contexto_actualizado': contexto}
+            
             logger.info(f"🤖 [OPENAI] Procesando con IA especializada")
             
             resultado_openai = self.openai_service.procesar_mensaje_cobranza(
@@ -384,13 +625,14 @@ class OptimizedChatProcessor:
                 )
                 
                 # Generar botones dinámicos
-                botones = self._generar_botones_dinamicos_openai(next_state, contexto)
+                botones = self._botones(
+                    'openai', next_state, contexto.get('cliente_encontrado', False)
+                )
                 
-                return {
+                resultado = {
                     'intencion': 'OPENAI_ENHANCED',
                     'confianza': 0.9,
                     'next_state': next_state,
-                    'contexto_actualizado': contexto,
                     'mensaje_respuesta': resultado_openai['message'],
                     'botones': botones,
                     'metodo': 'openai_cobranza_principal',
@@ -398,6 +640,10 @@ class OptimizedChatProcessor:
                     'success': True,
                     'ai_enhanced': True
                 }
+                # El contexto no se guarda en cache (se adjunta el actual en cada hit)
+                cache_service.cache_openai_response(mensaje_cache, contexto_hash, dict(resultado), ttl=1800)
+                
+                return {**resultado, 'contexto_actualizado': contexto}
             
             return {'success': False, 'razon': 'openai_no_enhanced'}
             
@@ -405,21 +651,24 @@ class OptimizedChatProcessor:
             logger.error(f"❌ [OPENAI] Error: {e}")
             return {'success': False, 'razon': f'error_openai: {e}'}
     
-    def _procesar_con_sistema_dinamico(self, mensaje: str, contexto: Dict[str, Any], estado: str) -> Dict[str, Any]:
+    def _procesar_con_sistema_dinamico(self, mensaje: str, contexto: Dict[str, Any], estado: str,
+                                       msg_norm: Optional[str] = None) -> Dict[str, Any]:
         """Fallback con sistema dinámico + ML"""
+        if msg_norm is None:
+            msg_norm = mensaje.translate(_ACCENT_MAP).lower().strip()
         try:
-            logger.info(f"🔧 [DINAMICO] Procesando con sistema dinámico")
+            logger.debug("🔧 [DINAMICO] Procesando con sistema dinámico")
             
             # Crear resultado ML
             ml_result = {}
             if self.ml_service:
-                ml_prediction = self.ml_service.predict(mensaje)
+                ml_prediction = self._ml_predict(msg_norm)
                 ml_result = {
                     'intention': ml_prediction.get('intention', 'DESCONOCIDA'),
                     'confidence': ml_prediction.get('confidence', 0.0),
                     'method': 'ml_classification'
                 }
-                logger.info(f"🤖 [ML] {ml_result['intention']} (confianza: {ml_result['confidence']:.2f})")
+                logger.debug("🤖 [ML] %s (confianza: %.2f)", ml_result['intention'], ml_result['confidence'])
             
             # Usar sistema dinámico
             transition_result = self.dynamic_transition_service.determine_next_state(
@@ -431,21 +680,25 @@ class OptimizedChatProcessor:
             
             # Capturar selección de plan si es relevante
             contexto_con_plan = self._capturar_seleccion_plan_dinamica(
-                mensaje, transition_result, contexto
+                msg_norm, transition_result, contexto
             )
             
+            tiene_cliente = contexto_con_plan.get('cliente_encontrado', False)
+            
             # Generar respuesta dinámica
             mensaje_respuesta = self._generar_respuesta_dinamica(
-                transition_result['next_state'], contexto_con_plan
+                transition_result['next_state'], contexto_con_plan,
+                tiene_cliente, contexto_con_plan.get('Nombre_del_cliente')
             )
             
             # Generar botones dinámicos
-            botones = self._generar_botones_dinamicos(
-                transition_result['next_state'], contexto_con_plan
+            botones = self._botones(
+                'dinamico', transition_result['next_state'], tiene_cliente
             )
             
-            logger.info(f"🎯 [DINAMICO] {estado} → {transition_result['next_state']}")
-            logger.info(f"🔧 Método: {transition_result['detection_method']}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🎯 [DINAMICO] %s → %s", estado, transition_result['next_state'])
+                logger.debug("🔧 Método: %s", transition_result['detection_method'])
             
             return {
                 'intencion': transition_result['condition_detected'],
@@ -462,34 +715,32 @@ class OptimizedChatProcessor:
             
         except Exception as e:
             logger.error(f"❌ [DINAMICO] Error: {e}")
-            return self._procesar_con_reglas_basicas(mensaje, contexto, estado)
+            return self._procesar_con_reglas_basicas(mensaje, contexto, estado, msg_norm)
     
-    def _capturar_seleccion_plan_dinamica(self, mensaje: str, transition_result: Dict, contexto: Dict) -> Dict[str, Any]:
-        """Capturar selección de plan de manera dinámica"""
+    def _capturar_seleccion_plan_dinamica(self, msg_norm: str, transition_result: Dict, contexto: Dict) -> Dict[str, Any]:
+        """Capturar selección de plan de manera dinámica (recibe el mensaje ya normalizado)"""
         
         condicion = transition_result.get('condition_detected', '')
         contexto_actualizado = contexto.copy()
         
         logger.info(f"🔍 [PLAN] Verificando captura: condición={condicion}")
         
-        mensaje_lower = mensaje.lower().strip()
-        
         # Si la condición indica selección de plan
         if condicion and condicion.startswith('cliente_selecciona_'):
-            plan_info = self._procesar_seleccion_por_condicion(condicion, contexto_actualizado, mensaje)
+            plan_info = self._procesar_seleccion_por_condicion(condicion, contexto_actualizado, msg_norm)
             if plan_info.get('plan_capturado'):
                 logger.info(f"✅ [PLAN] Capturado por condición: {plan_info['plan_seleccionado']}")
                 return plan_info
         
         # Detección directa por palabras clave
-        plan_detectado = self._detectar_plan_directo(mensaje_lower, contexto_actualizado)
+        plan_detectado = self._detectar_plan_directo(msg_norm, contexto_actualizado)
         if plan_detectado:
             logger.info(f"✅ [PLAN] Detectado directamente: {plan_detectado['plan_seleccionado']}")
             contexto_actualizado.update(plan_detectado)
             return contexto_actualizado
         
         # Detección por números/posiciones
-        plan_por_numero = self._detectar_seleccion_numerica(mensaje_lower, contexto_actualizado)
+        plan_por_numero = self._detectar_seleccion_numerica(msg_norm, contexto_actualizado)
         if plan_por_numero:
             logger.info(f"✅ [PLAN] Detectado por número: {plan_por_numero['plan_seleccionado']}")
             contexto_actualizado.update(plan_por_numero)
@@ -497,7 +748,7 @@ class OptimizedChatProcessor:
         
         return contexto_actualizado
     
-    def _detectar_plan_directo(self, mensaje_lower: str, contexto: Dict) -> Optional[Dict[str, Any]]:
+    def _detectar_plan_directo(self, msg_norm: str, contexto: Dict) -> Optional[Dict[str, Any]]:
         """Detectar plan directamente por palabras clave"""
         
         nombre = contexto.get('Nombre_del_cliente', 'Cliente')
@@ -507,30 +758,30 @@ class OptimizedChatProcessor:
         cuotas_6 = contexto.get('hasta_6_cuotas', 0)
         cuotas_12 = contexto.get('hasta_12_cuotas', 0)
         
-        if any(keyword in mensaje_lower for keyword in [
-            'pago unico', 'pago único', 'descuento', 'liquidar todo', 
+        if any(keyword in msg_norm for keyword in [
+            'pago unico', 'descuento', 'liquidar todo', 
             'pago completo', 'oferta especial'
         ]):
-            return self._generar_plan_pago_unico(nombre, saldo_total, oferta_2, mensaje_lower)
+            return self._generar_plan_pago_unico(nombre, saldo_total, oferta_2, msg_norm)
         
-        elif any(keyword in mensaje_lower for keyword in [
+        elif any(keyword in msg_norm for keyword in [
             '3 cuotas', 'tres cuotas', 'plan 3', 'plan de 3'
         ]):
             return self._generar_plan_cuotas(nombre, saldo_total, cuotas_3, 3, "3 cuotas sin interés")
         
-        elif any(keyword in mensaje_lower for keyword in [
+        elif any(keyword in msg_norm for keyword in [
             '6 cuotas', 'seis cuotas', 'plan 6', 'plan de 6'
         ]):
             return self._generar_plan_cuotas(nombre, saldo_total, cuotas_6, 6, "6 cuotas sin interés")
         
-        elif any(keyword in mensaje_lower for keyword in [
+        elif any(keyword in msg_norm for keyword in [
             '12 cuotas', 'doce cuotas', 'plan 12', 'plan de 12'
         ]):
             return self._generar_plan_cuotas(nombre, saldo_total, cuotas_12, 12, "12 cuotas sin interés")
         
         return None
     
-    def _detectar_seleccion_numerica(self, mensaje_lower: str, contexto: Dict) -> Optional[Dict[str, Any]]:
+    def _detectar_seleccion_numerica(self, msg_norm: str, contexto: Dict) -> Optional[Dict[str, Any]]:
         """Detectar selección por números o posiciones"""
         
         saldo_total = contexto.get('saldo_total', 0)
@@ -541,29 +792,29 @@ class OptimizedChatProcessor:
         nombre = contexto.get('Nombre_del_cliente', 'Cliente')
         
         # Mapeo de selecciones numéricas
-        if any(pattern in mensaje_lower for pattern in ['primera', 'primer', '1', 'uno']):
+        if any(pattern in msg_norm for pattern in ['primera', 'primer', '1', 'uno']):
             return self._generar_plan_pago_unico(nombre, saldo_total, oferta_2, "primera opción")
         
-        elif any(pattern in mensaje_lower for pattern in ['segunda', 'segundo', '2', 'dos']):
+        elif any(pattern in msg_norm for pattern in ['segunda', 'segundo', '2', 'dos']):
             return self._generar_plan_cuotas(nombre, saldo_total, cuotas_3, 3, "Plan 3 cuotas (segunda opción)")
         
-        elif any(pattern in mensaje_lower for pattern in ['tercera', 'tercer', '3', 'tres']): 
+        elif any(pattern in msg_norm for pattern in ['tercera', 'tercer', '3', 'tres']): 
             return self._generar_plan_cuotas(nombre, saldo_total, cuotas_6, 6, "Plan 6 cuotas (tercera opción)")
         
-        elif any(pattern in mensaje_lower for pattern in ['cuarta', 'cuarto', '4', 'cuatro']):
+        elif any(pattern in msg_norm for pattern in ['cuarta', 'cuarto', '4', 'cuatro']):
             return self._generar_plan_cuotas(nombre, saldo_total, cuotas_12, 12, "Plan 12 cuotas (cuarta opción)")
         
         return None
     
-    def _procesar_seleccion_por_condicion(self, condicion: str, contexto: Dict, mensaje: str) -> Dict[str, Any]:
-        """Procesar selección basada en condición BD"""
+    def _procesar_seleccion_por_condicion(self, condicion: str, contexto: Dict, msg_norm: str) -> Dict[str, Any]:
+        """Procesar selección basada en condición BD (mensaje ya normalizado)"""
         
         nombre = contexto.get('Nombre_del_cliente', 'Cliente')
         saldo_total = contexto.get('saldo_total', 0)
         
         if condicion == 'cliente_selecciona_pago_unico':
             oferta_2 = contexto.get('oferta_2', 0)
-            return self._generar_plan_pago_unico(nombre, saldo_total, oferta_2, mensaje)
+            return self._generar_plan_pago_unico(nombre, saldo_total, oferta_2, msg_norm)
         
         elif condicion == 'cliente_selecciona_plan_3_cuotas':
             cuotas_3 = contexto.get('hasta_3_cuotas', 0)
@@ -579,13 +830,13 @@ class OptimizedChatProcessor:
         
         elif condicion in ['cliente_selecciona_plan', 'cliente_confirma_plan_elegido']:
             # Detectar tipo de plan por el mensaje
-            plan_detectado = self._detectar_plan_directo(mensaje.lower(), contexto)
+            plan_detectado = self._detectar_plan_directo(msg_norm, contexto)
             if plan_detectado:
                 return plan_detectado
             
             # Fallback: pago único
             oferta_2 = contexto.get('oferta_2', 0)
-            return self._generar_plan_pago_unico(nombre, saldo_total, oferta_2, mensaje)
+            return self._generar_plan_pago_unico(nombre, saldo_total, oferta_2, msg_norm)
         
         return contexto
     
@@ -647,42 +898,41 @@ class OptimizedChatProcessor:
             'metodo_deteccion': f'cuotas_{num_cuotas}_optimizado'
         }
     
-    def _procesar_con_reglas_basicas(self, mensaje: str, contexto: Dict[str, Any], estado: str) -> Dict[str, Any]:
+    def _procesar_con_reglas_basicas(self, mensaje: str, contexto: Dict[str, Any], estado: str,
+                                     msg_norm: Optional[str] = None) -> Dict[str, Any]:
         """Último recurso: reglas básicas contextuales"""
         
-        mensaje_lower = mensaje.lower()
+        if msg_norm is None:
+            msg_norm = mensaje.translate(_ACCENT_MAP).lower().strip()
         tiene_cliente = contexto.get('cliente_encontrado', False)
         nombre = contexto.get('Nombre_del_cliente', 'Cliente')
         
         logger.info(f"🔧 [REGLAS] Fallback con reglas básicas")
         
         # Confirmaciones
-        if any(word in mensaje_lower for word in ['si', 'sí', 'acepto', 'ok', 'está bien', 'de acuerdo']):
-            if tiene_cliente and estado in ['informar_deuda', 'proponer_planes_pago']:
+        if any(word in msg_norm for word in _PALABRAS_CONFIRMACION):
+            if tiene_cliente and estado in _ESTADOS_PLAN:
                 return {
                     'intencion': 'CONFIRMACION_CONTEXTUAL',
                     'confianza': 0.8,
                     'next_state': 'proponer_planes_pago' if estado == 'informar_deuda' else 'generar_acuerdo',
                     'contexto_actualizado': contexto,
                     'mensaje_respuesta': f"Perfecto, {nombre}! Te muestro las opciones disponibles." if estado == 'informar_deuda' else f"Excelente, {nombre}! Procederé a generar tu acuerdo de pago.",
-                    'botones': self._generar_botones_contextuales(estado, contexto),
+                    'botones': self._botones('contextual', estado, tiene_cliente),
                     'metodo': 'reglas_confirmacion',
                     'usar_resultado': True,
                     'success': True
                 }
         
         # Rechazos
-        elif any(word in mensaje_lower for word in ['no', 'nop', 'negativo', 'imposible', 'no puedo']):
+        elif any(word in msg_norm for word in _PALABRAS_RECHAZO):
             return {
                 'intencion': 'RECHAZO_CONTEXTUAL',
                 'confianza': 0.8,
                 'next_state': 'gestionar_objecion',
                 'contexto_actualizado': contexto,
                 'mensaje_respuesta': f"Entiendo tu situación, {nombre if tiene_cliente else ''}. ¿Qué te preocupa específicamente? Podemos buscar alternativas.",
-                'botones': [
-                    {"id": "plan_flexible", "text": "Plan más flexible"},
-                    {"id": "asesor", "text": "Hablar con asesor"}
-                ],
+                'botones': list(_BTN_RECHAZO),
                 'metodo': 'reglas_rechazo',
                 'usar_resultado': True,
                 'success': True
@@ -691,16 +941,10 @@ class OptimizedChatProcessor:
         # Fallback genérico
         if tiene_cliente:
             mensaje_resp = f"¿En qué más puedo ayudarte, {nombre}? Si necesitas ver las opciones de pago, puedo mostrártelas."
-            botones = [
-                {"id": "opciones_pago", "text": "Ver opciones de pago"},
-                {"id": "asesor", "text": "Hablar con asesor"}
-            ]
+            botones = list(_BTN_FALLBACK_CON_CLIENTE)
         else:
             mensaje_resp = "Para ayudarte de la mejor manera, necesito que me proporciones tu número de cédula."
-            botones = [
-                {"id": "proporcionar_cedula", "text": "Proporcionar cédula"},
-                {"id": "ayuda", "text": "Necesito ayuda"}
-            ]
+            botones = list(_BTN_SOLICITAR_CEDULA)
         
         return {
             'intencion': 'REGLAS_FALLBACK',
@@ -714,46 +958,42 @@ class OptimizedChatProcessor:
             'success': True
         }
     
+    def _hash_contexto_openai(self, estado: str, contexto: Dict[str, Any]) -> str:
+        """Parte del contexto que cambia la respuesta: estado y cliente (las respuestas personalizadas no se comparten)"""
+        if not contexto.get('cliente_encontrado'):
+            return f"{estado}|sin_cliente"
+        return f"{estado}|{contexto.get('cedula_detectada')}|{contexto.get('saldo_total')}"
+    
     def _determinar_estado_desde_openai(self, resultado_openai: Dict, estado_actual: str, contexto: Dict) -> str:
         """Determinar siguiente estado basado en resultado OpenAI"""
         
-        mensaje = resultado_openai.get('message', '').lower()
-        tiene_cliente = contexto.get('cliente_encontrado', False)
-        
-        # Análisis del contenido del mensaje de OpenAI
-        if any(palabra in mensaje for palabra in ['opciones', 'planes', 'pago', 'cuotas']):
-            return 'proponer_planes_pago' if tiene_cliente else 'validar_documento'
-        elif any(palabra in mensaje for palabra in ['acuerdo', 'confirmar', 'proceder']):
-            return 'generar_acuerdo'
-        elif any(palabra in mensaje for palabra in ['supervisor', 'asesor', 'especialista']):
-            return 'escalamiento'
-        elif any(palabra in mensaje for palabra in ['información', 'detalle', 'saldo']):
-            return 'informar_deuda' if tiene_cliente else 'validar_documento'
+        # Análisis del contenido del mensaje de OpenAI: una sola pasada palabra → destino,
+        # gana la coincidencia de mayor prioridad
+        aciertos = [
+            _PALABRA_A_DESTINO[palabra]
+            for palabra in _TOKEN_RE.findall(resultado_openai.get('message', '').lower())
+            if palabra in _PALABRA_A_DESTINO
+        ]
+        destino = min(aciertos)[1] if aciertos else None
         
         # Lógica contextual por estado
-        estado_transitions = {
-            'inicial': 'validar_documento',
-            'validar_documento': 'informar_deuda' if tiene_cliente else 'validar_documento',
-            'informar_deuda': 'proponer_planes_pago',
-            'proponer_planes_pago': 'generar_acuerdo',
-            'generar_acuerdo': 'finalizar_conversacion'
-        }
-        
-        return estado_transitions.get(estado_actual, estado_actual)
+        if destino is None:
+            destino = _TRANSICION_POR_ESTADO.get(estado_actual)
+            if destino is None:
+                return estado_actual
+        
+        con_cliente, sin_cliente = destino
+        if con_cliente == sin_cliente:
+            return con_cliente
+        return con_cliente if contexto.get('cliente_encontrado', False) else sin_cliente
     
-    def _generar_respuesta_dinamica(self, estado: str, contexto: Dict[str, Any]) -> str:
-        """Generar respuesta desde tabla Estados_Conversacion"""
+    def _generar_respuesta_dinamica(self, estado: str, contexto: Dict[str, Any],
+                                    tiene_cliente: bool = False, nombre: Optional[str] = None) -> str:
+        """Generar respuesta desde tabla Estados_Conversacion (cliente y nombre ya resueltos por el llamador)"""
         try:
-            query = text("""
-                SELECT mensaje_template 
-                FROM Estados_Conversacion 
-                WHERE nombre = :estado AND activo = 1
-            """)
+            template = obtener_template_estado(self.db, estado)
             
-            result = self.db.execute(query, {"estado": estado}).fetchone()
-            
-            if result and result[0]:
-                template = result[0]
+            if template:
                 logger.info(f"✅ [TEMPLATE] Obtenido para estado '{estado}'")
                 
                 # Resolver variables si hay servicio disponible
@@ -769,10 +1009,8 @@ class OptimizedChatProcessor:
                     return template
             else:
                 # Fallback dinámico
-                tiene_cliente = contexto.get('cliente_encontrado', False)
                 if tiene_cliente:
-                    nombre = contexto.get('Nombre_del_cliente', 'Cliente')
-                    return f"¿En qué puedo ayudarte, {nombre}?"
+                    return f"¿En qué puedo ayudarte, {nombre or 'Cliente'}?"
                 else:
                     return "Para ayudarte, necesito tu número de cédula."
                 
@@ -782,115 +1020,21 @@ class OptimizedChatProcessor:
     
     def _generar_mensaje_cliente_encontrado(self, datos_cliente: Dict) -> str:
         """Generar mensaje personalizado cuando se encuentra cliente"""
-        nombre = datos_cliente['Nombre_del_cliente']
-        banco = datos_cliente['banco']
-        saldo = datos_cliente['saldo_total']
-        
-        return f"""¡Perfecto, {nombre}! 
-
-📋 **Información de tu cuenta:**
-🏦 Entidad: {banco}
-💰 Saldo actual: ${saldo:,}
-
-¿Te gustaría conocer las opciones de pago disponibles para ti?"""
+        return _mensaje_cliente_encontrado(
+            datos_cliente['Nombre_del_cliente'], datos_cliente['banco'], datos_cliente['saldo_total']
+        )
     
     def _generar_botones_cliente_encontrado(self, datos_cliente: Dict) -> List[Dict[str, str]]:
         """Botones cuando se encuentra cliente"""
-        return [
-            {"id": "ver_opciones", "text": "Sí, quiero ver opciones"},
-            {"id": "mas_info", "text": "Más información"},
-            {"id": "no_ahora", "text": "No por ahora"},
-            {"id": "asesor", "text": "Hablar con asesor"}
-        ]
-    
-    def _generar_botones_dinamicos(self, estado: str, contexto: Dict) -> List[Dict]:
-        """Generar botones dinámicos según estado y contexto"""
-        try:
-            tiene_cliente = contexto.get('cliente_encontrado', False)
-            
-            if estado == "informar_deuda" and tiene_cliente:
-                return [
-                    {"id": "si_opciones", "text": "Sí, quiero ver opciones"},
-                    {"id": "mas_info", "text": "Más información"},
-                    {"id": "no_ahora", "text": "No por ahora"}
-                ]
-            elif estado == "proponer_planes_pago" and tiene_cliente:
-                return [
-                    {"id": "pago_unico", "text": "Pago único con descuento"},
-                    {"id": "plan_3_cuotas", "text": "Plan 3 cuotas"},
-                    {"id": "plan_6_cuotas", "text": "Plan 6 cuotas"},
-                    {"id": "plan_12_cuotas", "text": "Plan 12 cuotas"}
-                ]
-            elif estado == "generar_acuerdo":
-                return [
-                    {"id": "confirmar_acuerdo", "text": "Confirmar acuerdo"},
-                    {"id": "modificar_terminos", "text": "Modificar términos"}
-                ]
-            elif estado == "finalizar_conversacion":
-                return [
-                    {"id": "nueva_consulta", "text": "Nueva consulta"},
-                    {"id": "finalizar", "text": "Finalizar"}
-                ]
-            else:
-                return [
-                    {"id": "ayuda", "text": "Necesito ayuda"},
-                    {"id": "asesor", "text": "Hablar con asesor"}
-                ]
-                
-        except Exception as e:
-            logger.error(f"❌ Error generando botones dinámicos: {e}")
-            return [{"id": "ayuda", "text": "Necesito ayuda"}]
-    
-    def _generar_botones_dinamicos_openai(self, estado: str, contexto: Dict) -> List[Dict]:
-        """Botones específicos para respuestas mejoradas por OpenAI"""
-        
-        tiene_cliente = contexto.get('cliente_encontrado', False)
-        
-        if tiene_cliente:
-            if estado in ['proponer_planes_pago', 'informar_deuda']:
-                return [
-                    {"id": "pago_unico", "text": "Pago único"},
-                    {"id": "plan_cuotas", "text": "Plan de cuotas"},
-                    {"id": "mas_descuento", "text": "¿Más descuento?"},
-                    {"id": "asesor", "text": "Hablar con asesor"}
-                ]
-            elif estado == 'generar_acuerdo':
-                return [
-                    {"id": "confirmar_acuerdo", "text": "Confirmar acuerdo"},
-                    {"id": "modificar", "text": "Modificar términos"}
-                ]
-            else:
-                return [
-                    {"id": "opciones_pago", "text": "Ver opciones"},
-                    {"id": "asesor", "text": "Hablar con asesor"}
-                ]
-        else:
-            return [
-                {"id": "proporcionar_cedula", "text": "Proporcionar cédula"},
-                {"id": "ayuda", "text": "Necesito ayuda"}
-            ]
+        return list(_BTN_CLIENTE_ENCONTRADO)
     
-    def _generar_botones_contextuales(self, estado: str, contexto: Dict) -> List[Dict]:
-        """Botones contextuales para reglas básicas"""
-        
-        tiene_cliente = contexto.get('cliente_encontrado', False)
-        
-        if estado == 'informar_deuda' and tiene_cliente:
-            return [
-                {"id": "ver_opciones", "text": "Ver opciones de pago"},
-                {"id": "mas_info", "text": "Más información"}
-            ]
-        elif estado == 'proponer_planes_pago' and tiene_cliente:
-            return [
-                {"id": "pago_unico", "text": "Pago único"},
-                {"id": "cuotas", "text": "Plan cuotas"},
-                {"id": "asesor", "text": "Hablar con asesor"}
-            ]
-        else:
-            return [
-                {"id": "ayuda", "text": "Necesito ayuda"},
-                {"id": "asesor", "text": "Hablar con asesor"}
-            ]
+    def _botones(self, variante: str, estado: str, tiene_cliente: bool) -> List[Dict]:
+        """Botones según variante ('dinamico', 'openai', 'contextual'), estado y presencia de cliente"""
+        tiene_cliente = bool(tiene_cliente)
+        botones = _BUTTON_TABLE.get((variante, estado, tiene_cliente))
+        if botones is None:
+            botones = _BOTONES_POR_DEFECTO[(variante, tiene_cliente)]
+        return list(botones)
 
 
 # ✅ FUNCIONES AUXILIARES
@@ -952,8 +1096,7 @@ def _recuperar_contexto_seguro(db: Session, conversation: Conversation) -> Dict[
         
         # 2. Consulta directa a BD como fallback
         try:
-            query = text("SELECT context_data FROM conversations WHERE id = :conv_id")
-            result = db.execute(query, {"conv_id": conversation.id}).fetchone()
+            result = db.execute(_CONTEXTO_QUERY, {"conv_id": conversation.id}).fetchone()
             
             if result and result[0]:
                 contexto = json.loads(result[0])
@@ -1122,6 +1265,7 @@ async def process_chat_message_OPTIMIZADO(
     request: ChatRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
+    processor: OptimizedChatProcessor = Depends(get_processor),
 ):
     """
     🎯 ENDPOINT PRINCIPAL OPTIMIZADO Y CORREGIDO
@@ -1153,8 +1297,7 @@ async def process_chat_message_OPTIMIZADO(
         logger.info(f"💬 Conversación {conversation.id} - Estado: {conversation.current_state}")
         logger.info(f"📋 Contexto: {len(contexto_actual)} elementos")
         
-        # ✅ 3. CREAR PROCESADOR OPTIMIZADO
-        processor = OptimizedChatProcessor(db)
+        # ✅ 3. PROCESADOR OPTIMIZADO (inyectado, servicios compartidos por proceso)
         
         # ✅ 4. PROCESAR MENSAJE CON SISTEMA OPTIMIZADO
         resultado_raw = processor.process_message_optimized(
@@ -1274,7 +1417,7 @@ async def process_chat_message_OPTIMIZADO(
                 conversation_id=conversation.id,
                 message="¿En qué puedo ayudarte? Para comenzar, proporciona tu cédula.",
                 current_state="inicial",
-                buttons=[{"id": "ayuda", "text": "Necesito ayuda"}],
+                buttons=list(_BTN_AYUDA),
                 context={}
             )
         
@@ -1299,7 +1442,8 @@ async def process_chat_message_OPTIMIZADO(
 # ✅ ENDPOINTS DE TESTING Y DIAGNÓSTICO
 
 @router.post("/test-sistema-optimizado")
-async def test_sistema_optimizado(db: Session = Depends(get_db)):
+async def test_sistema_optimizado(db: Session = Depends(get_db),
+                                  processor: OptimizedChatProcessor = Depends(get_processor)):
     """Test completo del sistema optimizado"""
     
     test_messages = [
@@ -1313,8 +1457,6 @@ async def test_sistema_optimizado(db: Session = Depends(get_db)):
     ]
     
     try:
-        processor = OptimizedChatProcessor(db)
-        
         results = []
         contexto_test = {}
         estado_test = "inicial"
@@ -1413,11 +1555,10 @@ async def test_sistema_optimizado(db: Session = Depends(get_db)):
         }
 
 @router.get("/test-openai-integration")
-async def test_openai_integration(db: Session = Depends(get_db)):
+async def test_openai_integration(db: Session = Depends(get_db),
+                                  processor: OptimizedChatProcessor = Depends(get_processor)):
     """Test específico de integración OpenAI"""
     try:
-        processor = OptimizedChatProcessor(db)
-        
         if not processor.openai_service or not processor.openai_service.disponible:
             return {
                 "openai_available": False,
@@ -1451,7 +1592,7 @@ async def test_openai_integration(db: Session = Depends(get_db)):
                 "tipo_interaccion": resultado_test.get('tipo_interaccion'),
                 "success": resultado_test.get('enhanced', False)
             },
-            "service_stats": processor.openai_service.get_stats(),
+            "service_stats": _openai_stats_cached(processor.openai_service),
             "recommendation": "✅ OpenAI funcionando correctamente" if resultado_test.get('enhanced') else "❌ Verificar configuración OpenAI"
         }
         
@@ -1463,11 +1604,10 @@ async def test_openai_integration(db: Session = Depends(get_db)):
         }
 
 @router.get("/health-sistema-completo")
-async def health_sistema_completo(db: Session = Depends(get_db)):
+async def health_sistema_completo(db: Session = Depends(get_db),
+                                  processor: OptimizedChatProcessor = Depends(get_processor)):
     """Health check completo del sistema optimizado"""
     try:
-        processor = OptimizedChatProcessor(db)
-        
         # Verificar componentes
         components_status = {
             "dynamic_transition_service": processor.dynamic_transition_service is not None,
@@ -1476,18 +1616,13 @@ async def health_sistema_completo(db: Session = Depends(get_db)):
             "variable_service": processor.variable_service is not None
         }
         
-        # Verificar tablas críticas
+        # Verificar tablas críticas (SQL directo al driver: nombres validados al importar)
         tables_status = {}
-        critical_tables = [
-            "Estados_Conversacion",
-            "ml_intention_mappings", 
-            "keyword_condition_patterns",
-            "ConsolidadoCampañasNatalia"
-        ]
+        conn = db.connection()
         
-        for table in critical_tables:
+        for table, sql_conteo in _CONTEO_TABLAS_CRITICAS:
             try:
-                result = db.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+                result = conn.exec_driver_sql(sql_conteo).scalar()
                 tables_status[table] = {"exists": True, "count": result}
             except Exception as e:
                 tables_status[table] = {"exists": False, "error": str(e)}
@@ -1530,23 +1665,15 @@ async def health_sistema_completo(db: Session = Depends(get_db)):
 # ✅ ENDPOINTS LEGACY MANTENIDOS PARA COMPATIBILIDAD
 
 @router.post("/test-cedula", response_model=CedulaTestResponse)
-async def test_cedula_inteligente(request: CedulaTestRequest, db: Session = Depends(get_db)):
+async def test_cedula_inteligente(request: CedulaTestRequest, db: Session = Depends(get_db),
+                                  processor: OptimizedChatProcessor = Depends(get_processor)):
     """Test de detección y consulta de cédulas"""
     try:
-        processor = OptimizedChatProcessor(db)
-        
-        test_messages = [
-            request.cedula,
-            f"mi cedula es {request.cedula}",
-            f"documento {request.cedula}",
-            f"cc: {request.cedula}"
-        ]
-        
-        cedula_detectada = None
-        for msg in test_messages:
-            cedula_detectada = processor._detectar_cedula_inteligente(msg)
-            if cedula_detectada:
-                break
+        # Una sola detección sobre la entrada normalizada (solo grupos de dígitos):
+        # las variantes con prefijo ("mi cedula es ...", "cc: ...") no aportaban coincidencias nuevas
+        cedula_detectada = processor._detectar_cedula_inteligente(
+            _NO_DIGITOS_RE.sub(' ', request.cedula)
+        )
         
         if cedula_detectada:
             resultado = processor._consultar_cliente_completo(cedula_detectada)
@@ -2,6 +2,7 @@ import uvicorn
 import logging
 from fastapi import FastAPI, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from contextlib import asynccontextmanager
@@ -27,8 +28,12 @@ except ImportError as e:
     admin_config = None
 
 try:
-    from app.core.config import settings
+    from app.core.config import settings, validate_settings
     print("✅ Settings importado")
+    try:
+        validate_settings()
+    except Exception as e:
+        print(f"⚠️ Error en validación de configuración: {e}")
 except ImportError as e:
     print(f"❌ Error importando settings: {e}")
     # Configuración por defecto
@@ -161,6 +166,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ✅ COMPRESIÓN GZIP: respuestas con contexto del cliente e historial (claves JSON muy repetidas);
+# las respuestas pequeñas (<512 bytes) se envían sin comprimir
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
 # ✅ INCLUIR ROUTERS DE FORMA SEGURA
 if chat:
     try:
@@ -214,6 +223,19 @@ async def startup_event():
     try:
         print("🚀 Iniciando sistema...")
         
+        # ✅ 0. THREADPOOL ALINEADO CON EL POOL DE BD
+        # Los endpoints síncronos (/chat/message, historial...) corren en el threadpool de anyio
+        # (40 hilos por defecto): con tantos hilos como conexiones posibles, la E/S de BD se
+        # solapa entre requests sin que los hilos esperen conexión ni las conexiones esperen hilo
+        try:
+            import anyio.to_thread
+            from app.db.session import POOL_SIZE, MAX_OVERFLOW
+            limiter = anyio.to_thread.current_default_thread_limiter()
+            limiter.total_tokens = POOL_SIZE + MAX_OVERFLOW
+            print(f"✅ Threadpool: {limiter.total_tokens} hilos (pool BD {POOL_SIZE}+{MAX_OVERFLOW})")
+        except Exception as e:
+            print(f"⚠️ No se pudo ajustar el threadpool: {e}")
+        
         # ✅ 1. VERIFICAR BD
         try:
             from app.db.session import SessionLocal
@@ -787,16 +809,31 @@ def setup_models():
 # ✅ CONFIGURAR MODELOS AL FINAL
 User, Conversation, Message = setup_models()
 
+# ✅ EVENT LOOP Y PARSER HTTP RÁPIDOS (uvicorn[standard]); uvloop no existe en Windows
+try:
+    import uvloop  # noqa: F401
+    _UVICORN_LOOP = "uvloop"
+except ImportError:
+    _UVICORN_LOOP = "asyncio"
+
+try:
+    import httptools  # noqa: F401
+    _UVICORN_HTTP = "httptools"
+except ImportError:
+    _UVICORN_HTTP = "h11"
+
 # ✅ FUNCIÓN PRINCIPAL CON MANEJO DE ERRORES
 if __name__ == "__main__":
     try:
-        print("🚀 Iniciando servidor...")
+        print(f"🚀 Iniciando servidor (loop={_UVICORN_LOOP}, http={_UVICORN_HTTP})...")
         uvicorn.run(
             "main:app", 
             host="0.0.0.0", 
             port=8000, 
             reload=True,
-            reload_excludes=["*.log", "backup_*", "models/*"]
+            reload_excludes=["*.log", "backup_*", "models/*"],
+            loop=_UVICORN_LOOP,
+            http=_UVICORN_HTTP
         )
     except KeyboardInterrupt:
         print("\n🛑 Servidor detenido por usuario")
@@ -290,6 +290,33 @@ class TestChatValidation:
         else:
             assert response.status_code in [200, 422]  # Puede rechazar o truncar
 
+class TestChatResponseContract:
+    """La respuesta de /message se serializa sin response_model: debe seguir cumpliendo ChatResponse"""
+    
+    def test_respuesta_cumple_chat_response(self):
+        """Botones válidos pasan, los malformados se descartan y el resultado valida como ChatResponse"""
+        from app.api.endpoints.chat import _respuesta_chat
+        from app.schemas.chat import ChatResponse
+        
+        response = _respuesta_chat(
+            conversation_id=1,
+            message="Hola",
+            current_state="inicial",
+            buttons=[
+                {"id": "ayuda", "text": "Necesito ayuda"},
+                {"id": "planes", "text": "Ver planes", "next_state": "proponer_planes_pago"},
+                {"id": 3, "text": "id no es str"},
+                {"text": "sin id"},
+                "no es dict"
+            ]
+        )
+        data = json.loads(response.body)
+        
+        ChatResponse.model_validate(data)
+        assert [b["id"] for b in data["buttons"]] == ["ayuda", "planes"]
+        assert data["context_data"] == {}
+
+
 # ========================================
 # FIXTURES ESPECÍFICAS PARA ESTOS TESTS
 # ========================================
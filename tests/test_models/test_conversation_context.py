@@ -0,0 +1,75 @@
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base
+from app.models.user import User
+from app.models.conversation import Conversation
+from app.models.message import Message
+
+
+@pytest.fixture
+def session():
+    """Sesión sobre SQLite en memoria con las tablas del modelo"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=1, email="user1@systemgroup.com", hashed_password="x",
+                full_name="Usuario 1", is_active=True, created_at=datetime.now()))
+    db.add(Conversation(id=1, user_id=1, current_state="inicial",
+                        context_data={"cliente_encontrado": True, "Nombre_del_cliente": "Cliente A",
+                                      "saldo_total": 1500000},
+                        created_at=datetime.now()))
+    db.commit()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+def _releer(db) -> dict:
+    """Contexto tal como quedó en BD (sin pasar por el identity map)"""
+    db.expire_all()
+    return db.get(Conversation, 1).context_data
+
+
+class TestConversationContextData:
+    """context_data: ida y vuelta JSON y detección de cambios"""
+
+    def test_round_trip_json(self, session):
+        """Decimal y fechas se serializan; al leer se obtiene un dict"""
+        conversation = session.get(Conversation, 1)
+        conversation.context_data = {"saldo_total": Decimal("2500000"), "fecha": datetime(2024, 5, 1, 10, 30)}
+        session.commit()
+
+        contexto = _releer(session)
+        assert contexto == {"saldo_total": 2500000, "fecha": "2024-05-01T10:30:00"}
+        assert isinstance(contexto, dict)
+
+    def test_modificacion_en_sitio_se_persiste(self, session):
+        """Cambiar el dict cargado en sitio emite UPDATE"""
+        conversation = session.get(Conversation, 1)
+        conversation.context_data.update({"Nombre_del_cliente": "Cliente B", "saldo_total": 900000})
+        session.commit()
+
+        contexto = _releer(session)
+        assert contexto["Nombre_del_cliente"] == "Cliente B"
+        assert contexto["saldo_total"] == 900000
+
+    def test_reasignar_dict_modificado_se_persiste(self, session):
+        """Modificar en sitio y reasignar el mismo contenido no pierde el cambio"""
+        conversation = session.get(Conversation, 1)
+        contexto = conversation.context_data
+        contexto["conversation_closed"] = True
+        conversation.context_data = dict(contexto)
+        session.commit()
+
+        assert _releer(session)["conversation_closed"] is True
+
+    def test_json_invalido_se_lee_como_none(self, session):
+        """Texto que no es JSON no rompe la carga de la conversación"""
+        session.execute(text("UPDATE conversations SET context_data = 'no-json' WHERE id = 1"))
+        session.commit()
+
+        assert _releer(session) is None
@@ -0,0 +1,34 @@
+import pytest
+from unittest.mock import patch
+from app.services import conversation_service as cs
+
+
+@pytest.fixture(autouse=True)
+def cache_limpia():
+    cs.invalidar_cache_clientes()
+    yield
+    cs.invalidar_cache_clientes()
+
+
+class TestClienteCache:
+    """Tests para la cache de clientes por cédula"""
+
+    def test_no_encontrado_vence_antes(self):
+        """Un "no encontrado" se cachea con TTL corto; un cliente encontrado con el TTL normal"""
+        with patch.object(cs.time, "monotonic", return_value=1000.0):
+            cs._cliente_cache_set("111", {"encontrado": False}, ttl=cs._CLIENTE_NO_ENCONTRADO_TTL)
+            cs._cliente_cache_set("222", {"encontrado": True})
+
+        with patch.object(cs.time, "monotonic", return_value=1000.0 + cs._CLIENTE_NO_ENCONTRADO_TTL + 1):
+            assert cs._cliente_cache_get("111") is None
+            assert cs._cliente_cache_get("222") == {"encontrado": True}
+
+    def test_invalidar_una_cedula(self):
+        """Invalidar una cédula no vacía el resto de la cache"""
+        cs._cliente_cache_set("111", {"encontrado": False})
+        cs._cliente_cache_set("222", {"encontrado": True})
+
+        cs.invalidar_cache_clientes("111")
+
+        assert cs._cliente_cache_get("111") is None
+        assert cs._cliente_cache_get("222") == {"encontrado": True}